@@ -57,10 +57,15 @@ from routes.auth import auth_bp
 from routes.groups import groups_bp
 from routes.expenses import expenses_bp
 from routes.settlements import settlements_bp
-from database import init_db, close_db
+from database import (init_db, close_db, add_bookmark_header, BOOKMARK_HEADER,
+                      warm_pool, shed_load, pool_monitor)
+from utils.cache import balance_cache, netting_cache, token_cache
+from utils.auth import password_hasher_stats
+from utils.json_provider import install_json_provider
 
 app = Flask(__name__)
 app.config.from_object(Config)
+install_json_provider(app)
 
 # --- FIX: Update CORS for Production ---
 # We must allow both your local dev environment AND your Vercel production URL.
@@ -78,13 +83,36 @@ if prod_origin:
 CORS(app, 
      origins=origins_list,
      supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization"],
+     allow_headers=["Content-Type", "Authorization", BOOKMARK_HEADER],
+     expose_headers=[BOOKMARK_HEADER],
      methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
 # ------------------------------------
 
-# Initialize database constraints and indexes
-with app.app_context():
-    init_db()
+# Constraints and indexes are created by `flask --app app migrate`, or on the
+# first query when the stored schema version is out of date (SCHEMA_AUTO_MIGRATE)
+@app.cli.command('migrate')
+def migrate():
+    """Create constraints and indexes and record the schema version"""
+    if not init_db():
+        raise SystemExit(1)
+
+@app.cli.command('repair-counters')
+def repair_counters():
+    """Recompute every group's member count, expense count and total spend"""
+    from models.group import Group
+    result = Group.repair_counters()
+    print(f"Checked {result['groups']} group(s), repaired {result['repaired']}")
+
+# Open pool connections at worker start when NEO4J_POOL_WARMUP is set; off by
+# default so cold starts stay cheap
+if Config.NEO4J_POOL_WARMUP:
+    try:
+        print(f"Warmed up {warm_pool()} database connections")
+    except Exception as e:
+        print(f"Connection pool warm-up failed: {e}")
+
+# Shed requests with 503 + Retry-After while the pool is saturated (ADMISSION_CONTROL)
+app.before_request(shed_load)
 
 # Register blueprints
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -97,6 +125,22 @@ app.register_blueprint(settlements_bp, url_prefix='/api/settlements')
 def health_check():
     return jsonify({"status": "healthy", "database": "neo4j"}), 200
 
+# Runtime counters (METRICS_ENABLED)
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    if not Config.METRICS_ENABLED:
+        return jsonify({"error": "Not found"}), 404
+    
+    return jsonify({
+        "caches": {
+            "balances": balance_cache.stats(),
+            "netting": netting_cache.stats(),
+            "tokens": token_cache.stats()
+        },
+        "pool": pool_monitor.stats(),
+        "passwordHasher": password_hasher_stats()
+    }), 200
+
 # Error handlers
 @app.errorhandler(404)
 def not_found(error):
@@ -106,6 +150,9 @@ def not_found(error):
 def internal_error(error):
     return jsonify({"error": "Internal server error"}), 500
 
+# Hand causal-consistency bookmarks back to the client
+app.after_request(add_bookmark_header)
+
 # Cleanup on shutdown
 @app.teardown_appcontext
 def shutdown_session(exception=None):
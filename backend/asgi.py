@@ -0,0 +1,139 @@
+"""
+Optional async serving mode for the read-heavy endpoints
+
+Serves group details and balances from Quart on the neo4j AsyncDriver, so one
+process holds many in-flight requests without a thread each and independent
+queries in a request run concurrently. Everything else stays on the Flask app.
+Requires the packages in requirements-async.txt:
+
+    hypercorn asgi:app
+"""
+
+import asyncio
+from functools import wraps
+from quart import Quart, request, jsonify
+from async_database import close_async_driver, add_bookmark_header
+from config import Config
+from database import BOOKMARK_HEADER, parse_bookmarks, limit_pool_size, ensure_schema, close_driver
+from models.access import AccessError
+from models.async_group import AsyncGroup
+from routes.settlements import settle_group, summarize_groups, net_groups, parse_top_k
+from utils.auth import decode_token, parse_auth_header
+from utils.cache import netting_cache
+
+app = Quart(__name__)
+
+# Queries go through the async driver; the sync one only rebuilds stale ledgers
+# and checks the schema, so it gets a small pool of its own
+limit_pool_size(Config.ASGI_SYNC_POOL_SIZE)
+
+# Hand causal-consistency bookmarks back to the client, as the Flask app does
+app.after_request(add_bookmark_header)
+
+def request_bookmarks():
+    """Bookmark values the client sent back from either app, if any"""
+    return parse_bookmarks(request.headers.get(BOOKMARK_HEADER))
+
+def require_auth(f):
+    """Async twin of utils.auth.require_auth"""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        token, error = parse_auth_header(request.headers.get('Authorization'))
+        if error:
+            return jsonify({"error": error}), 401
+
+        user_id = decode_token(token)
+        if not user_id:
+            return jsonify({"error": "Unauthorized - Invalid or expired token"}), 401
+
+        kwargs['current_user_id'] = user_id
+        return await f(*args, **kwargs)
+
+    return decorated_function
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    return jsonify({"status": "healthy", "database": "neo4j", "mode": "async"}), 200
+
+@app.route('/api/groups/<group_id>', methods=['GET'])
+@require_auth
+async def get_group(group_id, current_user_id):
+    """Get group details; the summary and the expenses are fetched concurrently"""
+    try:
+        if request.args.get('view') == 'summary':
+            group = await AsyncGroup.get_summary(group_id, current_user_id, request_bookmarks())
+        else:
+            group = await AsyncGroup.get_with_details(group_id, current_user_id, request_bookmarks(),
+                                                      normalized=request.args.get('format') == 'normalized')
+
+        return jsonify(group), 200
+
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        print(f"Get group error: {e}")
+        return jsonify({"error": "Failed to retrieve group"}), 500
+
+@app.route('/api/settlements/balances/group/<group_id>', methods=['GET'])
+@require_auth
+async def get_group_balances(group_id, current_user_id):
+    """Calculate and return balances and suggested payments for a group"""
+    try:
+        try:
+            top_k = parse_top_k(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Version, membership and balances come back in one round trip
+        group = await AsyncGroup.get_ledger(group_id, current_user_id, request_bookmarks())
+        result = settle_group(group_id, group['version'], lambda: group['balances'])
+
+        if top_k is not None:
+            result = dict(result, settlements=result['settlements'][:top_k])
+
+        return jsonify(result), 200
+
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        print(f"Calculate balances error: {e}")
+        return jsonify({"error": "Failed to calculate balances"}), 500
+
+@app.route('/api/settlements/balances', methods=['GET'])
+@require_auth
+async def get_all_balances(current_user_id):
+    """Get balances across all groups for the current user"""
+    try:
+        try:
+            top_k = parse_top_k(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        groups = await AsyncGroup.get_balances_for_user(current_user_id, request_bookmarks())
+
+        if request.args.get('net', '').lower() in ('1', 'true', 'yes'):
+            versions = tuple(sorted((group['id'], group['version']) for group in groups))
+            result = netting_cache.get(current_user_id, versions)
+            if result is None:
+                result = net_groups(groups)
+                netting_cache.set(current_user_id, versions, result)
+            if top_k is not None:
+                result = dict(result, settlements=result['settlements'][:top_k])
+            return jsonify(result), 200
+
+        return jsonify(summarize_groups(groups, top_k)), 200
+
+    except Exception as e:
+        print(f"Calculate all balances error: {e}")
+        return jsonify({"error": "Failed to calculate balances"}), 500
+
+@app.before_serving
+async def check_schema():
+    """Migrate an out-of-date schema before serving, as the Flask app does on its first query"""
+    if Config.SCHEMA_AUTO_MIGRATE:
+        await asyncio.to_thread(ensure_schema)
+
+@app.after_serving
+async def shutdown_driver():
+    await close_async_driver()
+    await asyncio.to_thread(close_driver)
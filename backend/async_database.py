@@ -0,0 +1,72 @@
+from neo4j import AsyncGraphDatabase, Bookmarks
+from quart import g, has_app_context
+from config import Config
+from database import BOOKMARK_HEADER, Records, format_bookmarks
+
+# Created on first use so importing this module never opens connections
+_driver = None
+
+def get_async_driver():
+    """Get the process-wide AsyncDriver used by the ASGI app"""
+    global _driver
+    if _driver is None:
+        Config.validate()
+        _driver = AsyncGraphDatabase.driver(
+            Config.NEO4J_URI,
+            auth=(Config.NEO4J_USERNAME, Config.NEO4J_PASSWORD),
+            max_connection_lifetime=3600,
+            max_connection_pool_size=Config.NEO4J_MAX_POOL_SIZE,
+            connection_acquisition_timeout=Config.NEO4J_ACQUISITION_TIMEOUT,
+            max_transaction_retry_time=Config.NEO4J_MAX_RETRY_TIME
+        )
+    return _driver
+
+async def _fetch(tx, query, params):
+    result = await tx.run(query, params)
+    return Records([record async for record in result])
+
+async def read(query, bookmarks=None, **params):
+    """
+    Run a read query as a managed transaction on its own session
+
+    A session serves one query at a time, so each call opens its own and
+    independent reads can be awaited together with asyncio.gather.
+
+    Args:
+        query: Cypher query
+        bookmarks: Raw bookmark values the read must observe (optional)
+        **params: Query parameters
+
+    Returns:
+        Records: The fetched records
+    """
+    async with get_async_driver().session(
+            database=Config.NEO4J_DATABASE,
+            bookmarks=Bookmarks.from_raw_values(bookmarks) if bookmarks else None) as session:
+        records = await session.execute_read(_fetch, query, params)
+        remember_bookmarks(await session.last_bookmarks())
+        return records
+
+def remember_bookmarks(bookmarks):
+    """Keep a session's bookmarks for the current request's response header"""
+    if has_app_context():
+        g.setdefault('bookmarks', set()).update(bookmarks.raw_values)
+
+async def add_bookmark_header(response):
+    """
+    Return the latest bookmarks of every session the request used
+    
+    Async twin of database.add_bookmark_header, so clients can move between
+    the two apps and keep reading their own writes.
+    """
+    header = format_bookmarks(g.get('bookmarks'))
+    if header:
+        response.headers[BOOKMARK_HEADER] = header
+    return response
+
+async def close_async_driver():
+    """Close the AsyncDriver (called on ASGI shutdown)"""
+    global _driver
+    if _driver is not None:
+        await _driver.close()
+        _driver = None
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark the async serving mode against the sync Flask app
+Fires the same read requests at both apps in-process and reports throughput
+and latency percentiles. Run against a database with real data:
+
+    python bench_async.py <user_id> <group_id> [--requests 200] [--concurrency 20]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils.auth import generate_token
+
+PATHS = [
+    '/api/settlements/balances',
+    '/api/settlements/balances/group/{group_id}',
+    '/api/groups/{group_id}'
+]
+
+def report(name, total, latencies):
+    """Print throughput and latency percentiles for one run"""
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"  {name:<6} {len(latencies) / total:8.1f} req/s   "
+          f"p50 {statistics.median(latencies) * 1000:7.1f} ms   p99 {p99 * 1000:7.1f} ms")
+
+def bench_sync(paths, headers, concurrency):
+    """Serve every path from the Flask app, one thread per in-flight request"""
+    from app import app
+
+    def call(path):
+        start = time.perf_counter()
+        response = app.test_client().get(path, headers=headers)
+        assert response.status_code == 200, (path, response.status_code)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(call, paths))
+    return time.perf_counter() - start, latencies
+
+async def bench_async(paths, headers, concurrency):
+    """Serve every path from the ASGI app with at most `concurrency` requests in flight"""
+    from asgi import app
+    client = app.test_client()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def call(path):
+        async with limit:
+            start = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            assert response.status_code == 200, (path, response.status_code)
+            return time.perf_counter() - start
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(call(path) for path in paths))
+    return time.perf_counter() - start, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('user_id')
+    parser.add_argument('group_id')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    headers = {'Authorization': f'Bearer {generate_token(args.user_id)}'}
+    paths = [PATHS[i % len(PATHS)].format(group_id=args.group_id) for i in range(args.requests)]
+
+    print("=" * 60)
+    print(f"{args.requests} requests, {args.concurrency} in flight")
+    print("=" * 60)
+
+    # Warm both apps up (connections, caches) before timing
+    bench_sync(paths[:len(PATHS)], headers, 1)
+    report('sync', *bench_sync(paths, headers, args.concurrency))
+
+    # The AsyncDriver belongs to one event loop, so warm-up and run share it
+    async def run_async():
+        await bench_async(paths[:len(PATHS)], headers, 1)
+        return await bench_async(paths, headers, args.concurrency)
+
+    report('async', *asyncio.run(run_async()))
+
+if __name__ == "__main__":
+    main()
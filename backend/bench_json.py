@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark group response payloads: embedded vs normalized, stdlib vs orjson
+Builds a synthetic group response both ways and reports its size and the time
+each JSON provider takes to encode it (no database needed):
+
+    python bench_json.py [--expenses 10000] [--members 200] [--participants 12] [--repeat 5]
+"""
+
+import argparse
+import random
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from bench_serializers import make_record, best_of
+from models.expense import Expense
+from utils.json_provider import OrjsonProvider
+from utils.serializers import USER, NodeRefs, normalize_group
+
+def build(record, members, normalized):
+    """A get_with_details response for the synthetic group"""
+    group = {
+        'id': 'group-1',
+        'name': 'Benchmark group',
+        'members': members,
+        'totalSpend': 0.0,
+        '_count': {'members': len(members), 'expenses': len(record['expenses']), 'settlements': 0}
+    }
+
+    if normalized:
+        users = NodeRefs(USER)
+        group['expenses'] = Expense.group_expenses_from_record(record, users)
+        return normalize_group(group, users)
+
+    group['expenses'] = Expense.group_expenses_from_record(record)
+    return group
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--expenses', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=200)
+    parser.add_argument('--participants', type=int, default=12, help='most participants per expense')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    record = make_record(args.expenses, args.members, args.participants)
+    users = NodeRefs(USER)
+    for row in record['expenses']:
+        users(row['paidBy'])
+        users.many(row['participants'])
+    members = list(users.all().values())
+
+    app = Flask(__name__)
+    providers = [('stdlib', DefaultJSONProvider(app))]
+    try:
+        providers.append(('orjson', OrjsonProvider(app)))
+    except ImportError:
+        print("orjson is not installed (pip install -r requirements-fast.txt); timing stdlib only")
+
+    print("=" * 60)
+    print(f"{args.expenses} expenses, {args.members} members, "
+          f"up to {args.participants} participants each, best of {args.repeat}")
+    print("=" * 60)
+
+    with app.app_context():
+        for shape in ('embedded', 'normalized'):
+            build_ms, group = best_of(args.repeat, build, record, members, shape == 'normalized')
+            size = len(providers[0][1].response(group).get_data())
+            timings = '   '.join(f"{name} {best_of(args.repeat, provider.response, group)[0]:7.1f} ms"
+                                 for name, provider in providers)
+            print(f"  {shape:<10} {size / 1024 / 1024:6.2f} MB   build {build_ms:6.1f} ms   encode: {timings}")
+
+if __name__ == "__main__":
+    main()
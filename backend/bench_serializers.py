@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark building the group expense list from Neo4j records
+Times the shared serializers against the per-field dict building the models
+used before, on a synthetic group shaped like real data (no database needed):
+
+    python bench_serializers.py [--expenses 10000] [--members 12] [--repeat 5]
+"""
+
+import argparse
+import json
+import random
+import time
+from neo4j.graph import Node
+from neo4j.time import DateTime
+from models.expense import Expense
+
+def make_record(expenses, members, max_participants=None):
+    """A group_expenses_query record for a group with the given sizes"""
+    users = [Node(None, f'u{i}', i, ['User'], {
+        'id': f'user-{i}', 'name': f'Member {i}', 'email': f'member{i}@example.com'
+    }) for i in range(members)]
+    rows = []
+
+    for i in range(expenses):
+        expense = Node(None, f'e{i}', members + i, ['Expense'], {
+            'id': f'expense-{i}',
+            'description': f'Expense {i}',
+            'amount': round(random.uniform(1, 500), 2),
+            'createdAt': DateTime(2024, 1 + i % 12, 1 + i % 28, i % 24, i % 60, i % 60, tzinfo=None)
+        })
+        rows.append({
+            'e': expense,
+            'paidBy': random.choice(users),
+            'participants': random.sample(users, random.randint(2, max_participants or members))
+        })
+
+    return {'expenses': rows}
+
+def legacy_group_expenses(record):
+    """How Expense.group_expenses_from_record built its dicts before utils.serializers"""
+    expenses = []
+
+    for row in record['expenses']:
+        expense_node = row['e']
+        paidBy = row['paidBy']
+        participants = [p for p in row['participants'] if p is not None]
+
+        expenses.append({
+            'id': expense_node['id'],
+            'description': expense_node['description'],
+            'amount': expense_node['amount'],
+            'createdAt': expense_node['createdAt'].isoformat() if hasattr(expense_node['createdAt'], 'isoformat') else str(expense_node['createdAt']),
+            'paidById': paidBy['id'] if paidBy else None,
+            'paidBy': {
+                'id': paidBy['id'],
+                'name': paidBy['name'],
+                'email': paidBy['email']
+            } if paidBy else None,
+            'participants': [{
+                'id': p['id'],
+                'name': p['name'],
+                'email': p['email']
+            } for p in participants]
+        })
+
+    return expenses
+
+def best_of(repeat, fn, *args):
+    """Fastest of `repeat` runs, in milliseconds, and the last result"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--expenses', type=int, default=10000)
+    parser.add_argument('--members', type=int, default=12)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    record = make_record(args.expenses, args.members)
+
+    print("=" * 60)
+    print(f"{args.expenses} expenses, {args.members} members, best of {args.repeat}")
+    print("=" * 60)
+
+    legacy_ms, legacy = best_of(args.repeat, legacy_group_expenses, record)
+    shared_ms, shared = best_of(args.repeat, Expense.group_expenses_from_record, record)
+    assert json.dumps(legacy, sort_keys=True) == json.dumps(shared, sort_keys=True)
+
+    print(f"  build  legacy {legacy_ms:8.1f} ms   serializers {shared_ms:8.1f} ms   "
+          f"({legacy_ms / shared_ms:.2f}x)")
+
+    legacy_ms, _ = best_of(args.repeat, json.dumps, legacy)
+    shared_ms, _ = best_of(args.repeat, json.dumps, shared)
+    print(f"  json   legacy {legacy_ms:8.1f} ms   serializers {shared_ms:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
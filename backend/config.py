@@ -12,11 +12,62 @@ class Config:
     NEO4J_USERNAME = os.getenv('NEO4J_USERNAME', 'neo4j')
     NEO4J_PASSWORD = os.getenv('NEO4J_PASSWORD')
     NEO4J_DATABASE = os.getenv('NEO4J_DATABASE', 'neo4j')
+    # Connection pool: connections per worker process, seconds a query waits for
+    # one before failing, and connections opened at worker start (0 = lazily)
+    NEO4J_MAX_POOL_SIZE = int(os.getenv('NEO4J_MAX_POOL_SIZE', 50))
+    NEO4J_ACQUISITION_TIMEOUT = float(os.getenv('NEO4J_ACQUISITION_TIMEOUT', 120))
+    NEO4J_POOL_WARMUP = int(os.getenv('NEO4J_POOL_WARMUP', 0))
+    # Sync connections an ASGI worker keeps next to its async pool (ledger rebuilds and the schema check)
+    ASGI_SYNC_POOL_SIZE = int(os.getenv('ASGI_SYNC_POOL_SIZE', 2))
+    # Seconds managed transactions keep retrying transient errors
+    NEO4J_MAX_RETRY_TIME = float(os.getenv('NEO4J_MAX_RETRY_TIME', 15))
+    # Check the schema version on the first query and migrate if it is out of date;
+    # turn off where deploys run `flask --app app migrate` instead
+    SCHEMA_AUTO_MIGRATE = os.getenv('SCHEMA_AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
     
     # JWT configuration
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', SECRET_KEY)
     JWT_ALGORITHM = 'HS256'
+    # Access tokens are short-lived and carry signed profile claims; refresh
+    # tokens last JWT_EXPIRATION_HOURS and only buy new access tokens
+    ACCESS_TOKEN_MINUTES = int(os.getenv('ACCESS_TOKEN_MINUTES', 15))
     JWT_EXPIRATION_HOURS = 24
+    # bcrypt work factor for new hashes (stored hashes are upgraded on login), the
+    # threads hashing at once and how many more logins may wait before a 429
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', 2))
+    BCRYPT_QUEUE_SIZE = int(os.getenv('BCRYPT_QUEUE_SIZE', 16))
+    # Verified tokens kept in process, and the seconds an entry is trusted for
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 4096))
+    TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 300))
+    
+    # Settle-up: 'auto' tries the minimum-payment solver within budget, 'greedy' skips it
+    SETTLE_STRATEGY = os.getenv('SETTLE_STRATEGY', 'auto')
+    SETTLE_OPTIMAL_MAX_PARTIES = int(os.getenv('SETTLE_OPTIMAL_MAX_PARTIES', 14))
+    SETTLE_TIME_BUDGET_MS = int(os.getenv('SETTLE_TIME_BUDGET_MS', 50))
+    
+    # Largest page served by paginated listings
+    MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 200))
+    STREAM_PAGE_SIZE = int(os.getenv('STREAM_PAGE_SIZE', 500))
+    
+    # Bulk import: expenses written per transaction and the most rows accepted per request
+    BULK_IMPORT_BATCH_SIZE = int(os.getenv('BULK_IMPORT_BATCH_SIZE', 1000))
+    BULK_IMPORT_MAX_ROWS = int(os.getenv('BULK_IMPORT_MAX_ROWS', 100000))
+
+    # Admission control: answer 503 + Retry-After while recent connection
+    # acquisition waits are above ADMISSION_MAX_WAIT_MS instead of queueing
+    ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'false').lower() in ('1', 'true', 'yes')
+    ADMISSION_MAX_WAIT_MS = int(os.getenv('ADMISSION_MAX_WAIT_MS', 500))
+    ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 2))
+
+    # GET /api/metrics exposes pool, cache and hasher internals, so it is off unless enabled
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+    # Entries kept in the in-process balance caches
+    BALANCE_CACHE_SIZE = int(os.getenv('BALANCE_CACHE_SIZE', 1024))
+
+    # JSON encoding: 'auto' uses orjson when installed, 'orjson' requires it, 'stdlib' never
+    JSON_PROVIDER = os.getenv('JSON_PROVIDER', 'auto')
     
     # Validation
     @staticmethod
@@ -1,34 +1,344 @@
-from neo4j import GraphDatabase
-from flask import g
+import time
+from threading import Lock
+from flask import g, request, has_request_context, jsonify
 from config import Config
 
-# Validate configuration on import
-Config.validate()
+# Bump whenever the constraints, indexes or backfills in init_db change, so
+# databases still on an older schema get them on their next migrate
+SCHEMA_VERSION = 3
 
-# Create the driver (singleton)
-driver = GraphDatabase.driver(
-    Config.NEO4J_URI,
-    auth=(Config.NEO4J_USERNAME, Config.NEO4J_PASSWORD),
-    max_connection_lifetime=3600,
-    max_connection_pool_size=50,
-    connection_acquisition_timeout=120
-)
+# The driver (singleton) is created on first use, so importing this module
+# on a cold start neither validates config nor opens connections
+_driver = None
+
+# Pool size the driver is created with; lowered by limit_pool_size
+_max_pool_size = Config.NEO4J_MAX_POOL_SIZE
+
+_schema_checked = False
+
+def get_driver():
+    """Get the Neo4j driver, creating it on first use"""
+    global _driver
+    if _driver is None:
+        from neo4j import GraphDatabase
+        
+        Config.validate()
+        _driver = GraphDatabase.driver(
+            Config.NEO4J_URI,
+            auth=(Config.NEO4J_USERNAME, Config.NEO4J_PASSWORD),
+            max_connection_lifetime=3600,
+            max_connection_pool_size=_max_pool_size,
+            connection_acquisition_timeout=Config.NEO4J_ACQUISITION_TIMEOUT,
+            max_transaction_retry_time=Config.NEO4J_MAX_RETRY_TIME
+        )
+    return _driver
+
+def limit_pool_size(size):
+    """
+    Cap the pool of the driver get_driver creates
+    
+    For processes that only make occasional sync queries (the ASGI app); must
+    be called before the driver is first used.
+    """
+    global _max_pool_size
+    _max_pool_size = min(size, Config.NEO4J_MAX_POOL_SIZE)
+
+def warm_pool(size=None):
+    """
+    Open pool connections up front so the first requests don't pay for the handshakes
+    
+    Holds `size` transactions open at once, which forces that many distinct
+    connections into the pool, then hands them all back idle.
+    
+    Args:
+        size: Connections to open (defaults to Config.NEO4J_POOL_WARMUP)
+    
+    Returns:
+        int: Connections opened
+    """
+    size = min(size or Config.NEO4J_POOL_WARMUP, Config.NEO4J_MAX_POOL_SIZE)
+    sessions, transactions = [], []
+    try:
+        for _ in range(size):
+            session = get_driver().session(database=Config.NEO4J_DATABASE)
+            sessions.append(session)
+            tx = session.begin_transaction()
+            transactions.append(tx)
+            tx.run("RETURN 1").consume()
+    finally:
+        for tx in transactions:
+            tx.close()
+        for session in sessions:
+            session.close()
+    return len(transactions)
+
+class PoolMonitor:
+    """
+    Connection pool usage and acquisition wait for this worker process
+    
+    The wait of a transaction is the time from asking for it until its work
+    starts, i.e. connection acquisition plus BEGIN. recent_wait is an
+    exponentially weighted average of those waits, which admission control
+    compares against Config.ADMISSION_MAX_WAIT_MS.
+    """
+    
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.waiting = 0
+        self.transactions = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.recent_wait = 0.0
+        self.last_sample = 0.0
+        self.shed = 0
+        self._lock = Lock()
+    
+    def start(self):
+        with self._lock:
+            self.waiting += 1
+    
+    def acquired(self, wait):
+        """Record the wait of a transaction that got its connection"""
+        with self._lock:
+            self.waiting -= 1
+            self.transactions += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            self.recent_wait += self.alpha * (wait - self.recent_wait)
+            self.last_sample = time.monotonic()
+    
+    def abandoned(self):
+        """A transaction failed before it got a connection"""
+        with self._lock:
+            self.waiting -= 1
+    
+    def record_shed(self):
+        with self._lock:
+            self.shed += 1
+    
+    def overloaded(self):
+        """
+        Whether recent acquisition waits are above the admission threshold
+        
+        Samples older than Config.ADMISSION_RETRY_AFTER seconds don't count,
+        so once load is shed the next request gets through to measure again.
+        """
+        if time.monotonic() - self.last_sample > Config.ADMISSION_RETRY_AFTER:
+            return False
+        return self.recent_wait * 1000 > Config.ADMISSION_MAX_WAIT_MS
+    
+    def stats(self):
+        """Get pool usage and wait counters; inUse/idle are None before the driver exists"""
+        in_use, idle = _pool_usage()
+        return {
+            'maxSize': _max_pool_size,
+            'inUse': in_use,
+            'idle': idle,
+            'waiting': self.waiting,
+            'transactions': self.transactions,
+            'avgWaitMs': self.total_wait * 1000 / self.transactions if self.transactions else 0.0,
+            'maxWaitMs': self.max_wait * 1000,
+            'recentWaitMs': self.recent_wait * 1000,
+            'shed': self.shed
+        }
+
+pool_monitor = PoolMonitor()
+
+def _pool_usage():
+    """Count in-use and idle connections in the driver's pool (None, None if unavailable)"""
+    pool = getattr(_driver, '_pool', None)
+    try:
+        connections = [conn for deque in list(pool.connections.values()) for conn in list(deque)]
+    except AttributeError:
+        return None, None
+    in_use = sum(1 for conn in connections if conn.in_use)
+    return in_use, len(connections) - in_use
+
+def shed_load():
+    """
+    Answer 503 + Retry-After while the pool is saturated (Config.ADMISSION_CONTROL)
+    
+    Registered with app.before_request, so shed requests never queue for a connection.
+    """
+    if not Config.ADMISSION_CONTROL or request.path in ('/api/health', '/api/metrics'):
+        return None
+    
+    if pool_monitor.overloaded():
+        pool_monitor.record_shed()
+        response = jsonify({"error": "Server busy, please retry"})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(Config.ADMISSION_RETRY_AFTER)
+        return response
+    return None
+
+# Clients echo this header back so their next request reads their own writes,
+# even when it lands on a different worker or a read replica
+BOOKMARK_HEADER = 'X-Neo4j-Bookmarks'
+
+class Records(list):
+    """Records fetched inside a managed transaction, still readable after it closes"""
+    
+    def single(self):
+        """Get the first record, or None if there were none"""
+        return self[0] if self else None
+
+def _fetch(tx, query, params):
+    return Records(tx.run(query, params))
+
+class Database:
+    """
+    Request session that runs every query as a managed transaction
+    
+    read() is routed to a reader when the URI is a routing scheme (neo4j://,
+    neo4j+s://) and write() to the leader. Both retry transient errors such
+    as leader switches and deadlocks for up to Config.NEO4J_MAX_RETRY_TIME
+    seconds, so their work must be safe to run more than once.
+    """
+    
+    def __init__(self, session):
+        self.session = session
+    
+    def read(self, query, **params):
+        """Run a read query and return its Records"""
+        return self._execute(self.session.execute_read, _fetch, query, params)
+    
+    def write(self, query, **params):
+        """Run a write query and return its Records"""
+        return self._execute(self.session.execute_write, _fetch, query, params)
+    
+    def write_transaction(self, work, *args):
+        """Run work(tx, *args) as one retried write transaction; tx.run results must be consumed inside"""
+        return self._execute(self.session.execute_write, work, *args)
+    
+    def _execute(self, execute, work, *args):
+        """Run a managed transaction, reporting how long it waited to start to pool_monitor"""
+        started = time.perf_counter()
+        waiting = [True]
+        
+        def timed(tx, *args):
+            if waiting:
+                pool_monitor.acquired(time.perf_counter() - started)
+                waiting.clear()
+            return work(tx, *args)
+        
+        pool_monitor.start()
+        try:
+            return execute(timed, *args)
+        finally:
+            if waiting:
+                pool_monitor.abandoned()
+    
+    def last_bookmarks(self):
+        return self.session.last_bookmarks()
+    
+    def close(self):
+        self.session.close()
+
+def parse_bookmarks(raw):
+    """Split a BOOKMARK_HEADER value into raw bookmark values (None if there are none)"""
+    return [value.strip() for value in (raw or '').split(',') if value.strip()] or None
+
+def format_bookmarks(values):
+    """Join raw bookmark values into a BOOKMARK_HEADER value (None if there are none)"""
+    return ','.join(sorted(values)) if values else None
+
+def _request_bookmarks():
+    """Bookmarks the client sent back from an earlier response, if any"""
+    if not has_request_context():
+        return None
+    
+    values = parse_bookmarks(request.headers.get(BOOKMARK_HEADER))
+    if not values:
+        return None
+    
+    from neo4j import Bookmarks
+    return Bookmarks.from_raw_values(values)
 
 def get_db():
     """Get database session from Flask's g object or create new one"""
+    global _schema_checked
+    if not _schema_checked and Config.SCHEMA_AUTO_MIGRATE:
+        ensure_schema()
+        _schema_checked = True
+    
     if 'db' not in g:
-        g.db = driver.session(database=Config.NEO4J_DATABASE)
+        g.db = Database(get_driver().session(database=Config.NEO4J_DATABASE,
+                                       bookmarks=_request_bookmarks()))
     return g.db
 
+def add_bookmark_header(response):
+    """
+    Return the request session's latest bookmarks to the client
+    
+    Set on every response that opened a session, reads included, so the
+    client can echo them back and read its own writes on any replica.
+    """
+    db = g.get('db')
+    if db is not None:
+        header = format_bookmarks(db.last_bookmarks().raw_values)
+        if header:
+            response.headers[BOOKMARK_HEADER] = header
+    return response
+
+class IdentityMap:
+    """
+    Records already looked up during the current request
+    
+    memberships maps (group_id, user_id) to whether the user is a member,
+    users maps ids to their record (None if known not to exist).
+    """
+    
+    def __init__(self):
+        self.memberships = {}
+        self.users = {}
+    
+    def forget_group(self, group_id):
+        """Drop everything known about a group after a write that changes it"""
+        for key in [key for key in self.memberships if key[0] == group_id]:
+            del self.memberships[key]
+
+def get_identity_map():
+    """Get the request-scoped IdentityMap from Flask's g object"""
+    if 'identity_map' not in g:
+        g.identity_map = IdentityMap()
+    return g.identity_map
+
 def close_db(e=None):
-    """Close database session"""
+    """Close database session and drop the request's identity map"""
+    g.pop('identity_map', None)
     db = g.pop('db', None)
     if db is not None:
         db.close()
 
+def ensure_schema():
+    """
+    Run init_db if the database's stored schema version is older than SCHEMA_VERSION
+    
+    Costs a single read when the schema is current.
+    
+    Returns:
+        bool: True if the schema was migrated
+    """
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
+        record = session.run("""
+        MATCH (s:SchemaVersion {name: 'schema'})
+        RETURN s.version as version
+        """).single()
+    
+    if record and record['version'] >= SCHEMA_VERSION:
+        return False
+    
+    return init_db()
+
 def init_db():
-    """Initialize database with constraints and indexes"""
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    """
+    Initialize database with constraints, indexes and backfills, then record SCHEMA_VERSION
+    
+    Returns:
+        bool: True if every statement succeeded (the version is only recorded then)
+    """
+    ok = True
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         # Create uniqueness constraints (automatically creates indexes)
         constraints = [
             "CREATE CONSTRAINT user_id_unique IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE",
@@ -36,6 +346,7 @@ def init_db():
             "CREATE CONSTRAINT group_id_unique IF NOT EXISTS FOR (g:Group) REQUIRE g.id IS UNIQUE",
             "CREATE CONSTRAINT expense_id_unique IF NOT EXISTS FOR (e:Expense) REQUIRE e.id IS UNIQUE",
             "CREATE CONSTRAINT settlement_id_unique IF NOT EXISTS FOR (s:Settlement) REQUIRE s.id IS UNIQUE",
+            "CREATE CONSTRAINT schema_version_unique IF NOT EXISTS FOR (s:SchemaVersion) REQUIRE s.name IS UNIQUE",
         ]
         
         for constraint in constraints:
@@ -45,11 +356,13 @@ def init_db():
             except Exception as e:
                 if "EquivalentSchemaRuleAlreadyExists" not in str(e):
                     print(f"✗ Error creating constraint: {e}")
+                    ok = False
         
         # Create additional indexes for performance
         indexes = [
             "CREATE INDEX user_name_idx IF NOT EXISTS FOR (u:User) ON (u.name)",
             "CREATE INDEX expense_created_idx IF NOT EXISTS FOR (e:Expense) ON (e.createdAt)",
+            "CREATE INDEX expense_group_created_idx IF NOT EXISTS FOR (e:Expense) ON (e.groupId, e.createdAt, e.id)",
             "CREATE INDEX settlement_paid_idx IF NOT EXISTS FOR (s:Settlement) ON (s.paidAt)",
         ]
         
@@ -60,9 +373,46 @@ def init_db():
             except Exception as e:
                 if "EquivalentSchemaRuleAlreadyExists" not in str(e):
                     print(f"✗ Error creating index: {e}")
+                    ok = False
+        
+        # Backfill the groupId that expense_group_created_idx pages a group's expenses by
+        if ok:
+            try:
+                summary = session.run("""
+                MATCH (g:Group)<-[:BELONGS_TO]-(e:Expense)
+                WHERE e.groupId IS NULL
+                CALL {
+                    WITH g, e
+                    SET e.groupId = g.id
+                } IN TRANSACTIONS OF 10000 ROWS
+                """).consume()
+                print(f"✓ Backfilled groupId on {summary.counters.properties_set} expense(s)")
+            except Exception as e:
+                print(f"✗ Error backfilling expense groupId: {e}")
+                ok = False
+        
+        # Backfill the denormalized group counters on groups created before them
+        if ok:
+            from models.group import Group
+            try:
+                counters = Group.repair_counters(only_missing=True, tx=session)
+                print(f"✓ Backfilled counters on {counters['repaired']} group(s)")
+            except Exception as e:
+                print(f"✗ Error backfilling group counters: {e}")
+                ok = False
         
-        print("\n✅ Database initialization complete!")
+        if ok:
+            session.run("""
+            MERGE (s:SchemaVersion {name: 'schema'})
+            SET s.version = $version, s.migratedAt = datetime()
+            """, version=SCHEMA_VERSION)
+            print(f"\n✅ Database initialization complete! (schema version {SCHEMA_VERSION})")
+    
+    return ok
 
 def close_driver():
     """Close the driver connection (called on application shutdown)"""
-    driver.close()
+    global _driver
+    if _driver is not None:
+        _driver.close()
+        _driver = None
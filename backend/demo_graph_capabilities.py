@@ -4,7 +4,7 @@ Demo script showcasing Neo4j's graph database capabilities
 Perfect for assignment demonstration!
 """
 
-from database import driver
+from database import get_driver, close_driver
 from config import Config
 import time
 
@@ -18,7 +18,7 @@ def demo_complex_relationships():
     """Demonstrate complex relationship queries"""
     print_section("1. COMPLEX RELATIONSHIP QUERIES")
     
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         print("\n📊 Query: Find all users who share groups with me")
         print("Cypher:")
         print("  MATCH (me:User {id: $myId})-[:MEMBER_OF]->(g:Group)")
@@ -43,7 +43,7 @@ def demo_graph_traversal():
     """Demonstrate graph traversal capabilities"""
     print_section("2. GRAPH TRAVERSAL - WHO OWES WHOM?")
     
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         print("\n📊 Query: Find all expense relationships (payer → participants)")
         print("Cypher:")
         print("  MATCH (payer:User)-[:PAID]->(e:Expense)<-[:PARTICIPANT_IN]-(participant:User)")
@@ -71,7 +71,7 @@ def demo_pattern_matching():
     """Demonstrate pattern matching"""
     print_section("3. PATTERN MATCHING - EXPENSE CHAINS")
     
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         print("\n📊 Query: Find expense patterns in groups")
         print("Cypher:")
         print("  MATCH (u:User)-[:PAID]->(e:Expense)-[:BELONGS_TO]->(g:Group)")
@@ -102,7 +102,7 @@ def demo_aggregations():
     """Demonstrate efficient aggregations"""
     print_section("4. GRAPH AGGREGATIONS")
     
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         print("\n📊 Query: Calculate each user's total spending and debt")
         print("Cypher:")
         print("  MATCH (u:User)")
@@ -134,7 +134,7 @@ def demo_path_finding():
     """Demonstrate path finding capabilities"""
     print_section("5. PATH FINDING - DEBT CHAINS")
     
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         print("\n📊 Query: Find indirect debt relationships")
         print("Cypher:")
         print("  MATCH path = (u1:User)-[:PAID|PARTICIPANT_IN*1..3]-(u2:User)")
@@ -165,7 +165,7 @@ def demo_statistics():
     """Show database statistics"""
     print_section("6. DATABASE STATISTICS")
     
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         # Count nodes
         result = session.run("""
             MATCH (n)
@@ -193,7 +193,7 @@ def demo_performance():
     """Demonstrate query performance"""
     print_section("7. QUERY PERFORMANCE")
     
-    with driver.session(database=Config.NEO4J_DATABASE) as session:
+    with get_driver().session(database=Config.NEO4J_DATABASE) as session:
         print("\n⚡ Testing query performance...")
         
         queries = [
@@ -231,11 +231,11 @@ def main():
     
     try:
         # Verify connection
-        driver.verify_connectivity()
+        get_driver().verify_connectivity()
         print("\n✅ Connected to Neo4j!")
         
         # Check if we have data
-        with driver.session(database=Config.NEO4J_DATABASE) as session:
+        with get_driver().session(database=Config.NEO4J_DATABASE) as session:
             result = session.run("MATCH (n) RETURN count(n) as nodeCount")
             node_count = result.single()['nodeCount']
             
@@ -281,7 +281,7 @@ def main():
         print("  2. .env file is configured")
         print("  3. You have data in the database")
     finally:
-        driver.close()
+        close_driver()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
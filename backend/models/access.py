@@ -0,0 +1,48 @@
+from database import get_identity_map
+
+
+class AccessError(Exception):
+    """A request could not be served for the current user; status is the HTTP code to answer with"""
+    status = 400
+
+
+class NotFoundError(AccessError):
+    status = 404
+
+
+class ForbiddenError(AccessError):
+    status = 403
+
+
+# Cypher prefix that checks membership in the same round trip as the real work.
+# Matches the group by $groupId and the user by $userId, and leaves g, u (null
+# unless a member), access (their MEMBER_OF relationship) and isMember in scope.
+# Queries built on it return no rows when the group does not exist; otherwise
+# they return isMember alongside their results, for check_access.
+GROUP_ACCESS = """
+        MATCH (g:Group {id: $groupId})
+        OPTIONAL MATCH (u:User {id: $userId})-[access:MEMBER_OF]->(g)
+        WITH g, u, access, access IS NOT NULL as isMember
+"""
+
+
+def check_access(record, what='Group', membership=None):
+    """
+    Raise the right error for a record returned by a GROUP_ACCESS query
+
+    Args:
+        record: The single record of the query, or None if it returned nothing
+        what: Name of the missing thing for the not-found message
+        membership: (group_id, user_id) the query checked; the outcome is
+                    remembered in the request's identity map (optional)
+
+    Raises:
+        NotFoundError: If the query matched nothing
+        ForbiddenError: If the user is not a member of the group
+    """
+    if record is None:
+        raise NotFoundError(f"{what} not found")
+    if membership is not None:
+        get_identity_map().memberships[membership] = record['isMember']
+    if not record['isMember']:
+        raise ForbiddenError("Forbidden")
@@ -0,0 +1,114 @@
+import asyncio
+from async_database import read, remember_bookmarks
+from config import Config
+from database import Database, get_driver
+from models.access import GROUP_ACCESS, check_access
+from models.expense import Expense
+from models.group import Group
+from utils.serializers import USER, NodeRefs, normalize_group
+
+def _rebuild_ledgers(group_ids):
+    """
+    Run the sync ledger rebuild in its own write transaction on the sync driver
+
+    The ASGI app caps that driver's pool (Config.ASGI_SYNC_POOL_SIZE), and the
+    transaction goes through Database so pool_monitor sees its wait.
+
+    Returns:
+        tuple: (ledgers, bookmarks of the write)
+    """
+    db = Database(get_driver().session(database=Config.NEO4J_DATABASE))
+    try:
+        ledgers = db.write_transaction(lambda tx: Group.rebuild_ledgers(group_ids, tx=tx))
+        return ledgers, db.last_bookmarks()
+    finally:
+        db.close()
+
+class AsyncGroup:
+    """
+    Read-only Group queries on the AsyncDriver, for the ASGI app
+
+    Queries and record handling come from the sync models, so both apps
+    return the same shapes.
+    """
+
+    @staticmethod
+    async def get_summary(group_id, user_id, bookmarks=None):
+        """Get group metadata, members and counts; raises NotFoundError or ForbiddenError"""
+        records = await read(Group.summary_query(), bookmarks, groupId=group_id, userId=user_id)
+        record = records.single()
+        check_access(record)
+        return Group.summary_from_record(record)
+
+    @staticmethod
+    async def get_expenses(group_id, user_id, bookmarks=None, users=None):
+        """Get all expenses of a group, newest first; raises NotFoundError or ForbiddenError"""
+        records = await read(Expense.group_expenses_query(), bookmarks, groupId=group_id, userId=user_id,
+                             limit=None, afterCreatedAt=None, afterId=None)
+        record = records.single()
+        check_access(record)
+        return Expense.group_expenses_from_record(record, users)
+
+    @staticmethod
+    async def get_with_details(group_id, user_id, bookmarks=None, normalized=False):
+        """Get group with members and all of its expenses, fetching both concurrently"""
+        users = NodeRefs(USER) if normalized else None
+        tasks = [
+            asyncio.ensure_future(AsyncGroup.get_summary(group_id, user_id, bookmarks)),
+            asyncio.ensure_future(AsyncGroup.get_expenses(group_id, user_id, bookmarks, users))
+        ]
+        try:
+            group, expenses = await asyncio.gather(*tasks)
+        except BaseException:
+            # Don't leave the other query running once the request has failed
+            for task in tasks:
+                task.cancel()
+            raise
+        group['expenses'] = expenses
+        return normalize_group(group, users) if normalized else group
+
+    @staticmethod
+    async def get_ledger(group_id, user_id, bookmarks=None):
+        """
+        Get a group's version and member balances (in cents) in one round trip
+
+        Raises NotFoundError or ForbiddenError.
+
+        Returns:
+            dict: {id, name, version, balances}
+        """
+        query = GROUP_ACCESS + """
+        MATCH (g)<-[rel:MEMBER_OF]-(member:User)
+        RETURN g, isMember, collect({id: member.id, balance: rel.balanceCents}) as balances
+        """
+
+        records = await read(query, bookmarks, groupId=group_id, userId=user_id)
+        record = records.single()
+        check_access(record)
+
+        group = Group.ledger_from_record(record)
+        if group.pop('stale'):
+            group['balances'] = (await AsyncGroup.rebuild_ledgers([group_id])).get(group_id, {})
+        return group
+
+    @staticmethod
+    async def get_balances_for_user(user_id, bookmarks=None):
+        """Get the ledger balances (in cents) of every group a user belongs to in one query"""
+        records = await read(Group.balances_for_user_query(), bookmarks, userId=user_id)
+        groups = [Group.ledger_from_record(record) for record in records]
+        stale_ids = [group['id'] for group in groups if group.pop('stale')]
+
+        if stale_ids:
+            rebuilt = await AsyncGroup.rebuild_ledgers(stale_ids)
+            for group in groups:
+                if group['id'] in rebuilt:
+                    group['balances'] = rebuilt[group['id']]
+
+        return groups
+
+    @staticmethod
+    async def rebuild_ledgers(group_ids):
+        """Rebuild stale ledgers with the sync model in a worker thread (a one-off per group)"""
+        ledgers, bookmarks = await asyncio.to_thread(_rebuild_ledgers, group_ids)
+        remember_bookmarks(bookmarks)
+        return ledgers
@@ -1,64 +1,187 @@
 import uuid
 from database import get_db
-from datetime import datetime
+from models.access import GROUP_ACCESS, check_access
+from utils.cache import balance_cache
+from utils.money import to_cents, from_cents
+from utils.serializers import EXPENSE, GROUP, USER, USER_REF, NodeRefs, expense_dict, expense_ref_dict
+
+class BulkImportError(Exception):
+    """
+    A bulk import batch failed after earlier batches were committed
+
+    created is the number of expenses already written and row the 1-based
+    input row the failed batch started at; that batch and the rest were not.
+    """
+
+    def __init__(self, created, row):
+        super().__init__(f"Import failed at row {row} after {created} expenses were created")
+        self.created = created
+        self.row = row
+
 
 class Expense:
     @staticmethod
     def create(description, amount, group_id, paid_by_id, participant_ids):
-        """Create a new expense in a group"""
+        """
+        Create a new expense in a group (amount is converted to integer cents)
+        
+        Membership is checked in the same query. Raises NotFoundError or
+        ForbiddenError, and returns None if no participant is a member.
+        """
         db = get_db()
         expense_id = str(uuid.uuid4())
+        amount_cents = to_cents(amount)
         
-        query = """
-        // Verify payer is a member of the group
-        MATCH (payer:User {id: $paidById})-[:MEMBER_OF]->(g:Group {id: $groupId})
-        
-        // Create the expense
-        CREATE (e:Expense {
-            id: $expenseId,
-            description: $description,
-            amount: $amount,
-            createdAt: datetime()
-        })
-        
-        // Link expense to group and payer
-        CREATE (e)-[:BELONGS_TO]->(g)
-        CREATE (payer)-[:PAID]->(e)
-        
-        // Link all participants
-        WITH e, g
-        UNWIND $participantIds as participantId
-        MATCH (participant:User {id: participantId})-[:MEMBER_OF]->(g)
-        CREATE (participant)-[:PARTICIPANT_IN]->(e)
-        
-        // ADD THIS LINE
-        WITH DISTINCT e
-        
-        RETURN e
+        query = GROUP_ACCESS + """
+        // Only members can add expenses; the payer is the current user
+        CALL {
+            WITH g, u, access, isMember
+            WITH g, u as payer, access as payerRel
+            WHERE isMember
+            
+            // Collect the participants who are members, in id order for a deterministic split,
+            // and stop before writing anything when none are
+            UNWIND $participantIds as participantId
+            MATCH (participant:User {id: participantId})-[rel:MEMBER_OF]->(g)
+            WITH g, payer, payerRel, participant, rel
+            ORDER BY participant.id
+            WITH g, payer, payerRel, collect(participant) as participants, collect(rel) as rels
+            WHERE size(rels) > 0
+            
+            // Create the expense
+            CREATE (e:Expense {
+                id: $expenseId,
+                groupId: $groupId,
+                description: $description,
+                amount: $amount,
+                amountCents: $amountCents,
+                createdAt: datetime()
+            })
+            
+            // Link expense to group and payer
+            CREATE (e)-[:BELONGS_TO]->(g)
+            CREATE (payer)-[:PAID]->(e)
+            SET g.version = coalesce(g.version, 0) + 1,
+                g.expenseCount = coalesce(g.expenseCount, 0) + 1,
+                g.totalSpendCents = coalesce(g.totalSpendCents, 0) + e.amountCents
+            
+            // Credit the payer on the balance ledger in the same transaction
+            SET payerRel.balanceCents = coalesce(payerRel.balanceCents, 0) + e.amountCents
+            
+            // Link each participant with their share; the first (amount % n) get one extra cent
+            WITH e, participants, rels, e.amountCents / size(rels) as base, e.amountCents % size(rels) as remainder
+            UNWIND range(0, size(rels) - 1) as i
+            WITH e, participants[i] as participant, rels[i] as rel,
+                 base + CASE WHEN i < remainder THEN 1 ELSE 0 END as share
+            CREATE (participant)-[:PARTICIPANT_IN {shareCents: share}]->(e)
+            SET rel.balanceCents = coalesce(rel.balanceCents, 0) - share
+            
+            RETURN collect(DISTINCT e) as created
+        }
+        RETURN isMember, created
         """
         
-        result = db.run(query,
+        result = db.write(query,
                        expenseId=expense_id,
                        description=description,
-                       amount=float(amount),
+                       amount=from_cents(amount_cents),
+                       amountCents=amount_cents,
                        groupId=group_id,
-                       paidById=paid_by_id,
-                       participantIds=participant_ids)
+                       userId=paid_by_id,
+                       participantIds=list(dict.fromkeys(participant_ids)))
         
         record = result.single()
-        if record:
-            expense_node = record['e']
-            return {
-                'id': expense_node['id'],
-                'description': expense_node['description'],
-                'amount': expense_node['amount'],
-                'createdAt': expense_node['createdAt'].isoformat() if hasattr(expense_node['createdAt'], 'isoformat') else str(expense_node['createdAt'])
-            }
+        check_access(record, membership=(group_id, paid_by_id))
+        
+        if record['created']:
+            balance_cache.invalidate(group_id)
+            return EXPENSE(record['created'][0])
         return None
     
     @staticmethod
-    def find_by_id(expense_id):
-        """Find expense by ID with all details"""
+    def create_many(group_id, rows, batch_size):
+        """
+        Create many expenses in a group with one write transaction per batch
+
+        Rows come from utils.imports.prepare_expense_rows, so payers and
+        participants are already known members and shares are precomputed.
+        Each batch writes its expenses with UNWIND, and the ledger deltas are
+        summed from the expenses and shares that write returns, so a row whose
+        payer or participant went missing moves no balance it didn't record.
+
+        Raises:
+            BulkImportError: If a batch fails; earlier batches stay committed
+        """
+        db = get_db()
+        created = 0
+
+        create_query = """
+        MATCH (g:Group {id: $groupId})
+        UNWIND $rows as row
+        MATCH (payer:User {id: row.paidById})
+        CREATE (e:Expense {
+            id: row.id,
+            groupId: $groupId,
+            description: row.description,
+            amount: row.amount,
+            amountCents: row.amountCents,
+            createdAt: CASE WHEN row.createdAt IS NULL THEN datetime() ELSE datetime(row.createdAt) END
+        })
+        CREATE (e)-[:BELONGS_TO]->(g)
+        CREATE (payer)-[:PAID]->(e)
+        WITH g, e, row
+        CALL {
+            WITH e, row
+            UNWIND row.shares as share
+            MATCH (participant:User {id: share.id})
+            CREATE (participant)-[:PARTICIPANT_IN {shareCents: share.shareCents}]->(e)
+            RETURN collect({id: share.id, balanceCents: -share.shareCents}) as debits
+        }
+        
+        // Count only the expenses and shares actually written
+        WITH g, e, [{id: row.paidById, balanceCents: e.amountCents}] + debits as entries
+        WITH g, collect(e) as created, reduce(all = [], list IN collect(entries) | all + list) as entries
+        SET g.version = coalesce(g.version, 0) + 1,
+            g.expenseCount = coalesce(g.expenseCount, 0) + size(created),
+            g.totalSpendCents = coalesce(g.totalSpendCents, 0) + reduce(total = 0, e IN created | total + e.amountCents)
+        RETURN size(created) as created, entries
+        """
+
+        ledger_query = """
+        UNWIND $deltas as delta
+        MATCH (:User {id: delta.id})-[rel:MEMBER_OF]->(g:Group {id: $groupId})
+        SET rel.balanceCents = coalesce(rel.balanceCents, 0) + delta.balanceCents
+        """
+
+        def write_batch(tx, batch):
+            record = tx.run(create_query, groupId=group_id, rows=batch).single()
+            if not record:
+                return 0
+
+            deltas = {}
+            for entry in record['entries']:
+                deltas[entry['id']] = deltas.get(entry['id'], 0) + entry['balanceCents']
+            tx.run(ledger_query, groupId=group_id,
+                   deltas=[{'id': k, 'balanceCents': v} for k, v in deltas.items() if v]).consume()
+            return record['created']
+
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            try:
+                created += db.write_transaction(write_batch, batch)
+            except Exception as e:
+                raise BulkImportError(created, batch[0]['row']) from e
+            balance_cache.invalidate(group_id)
+
+        return created
+
+    @staticmethod
+    def find_by_id(expense_id, user_id):
+        """
+        Find expense by ID with all details, checking the user is a member of its group
+        
+        Raises NotFoundError or ForbiddenError.
+        """
         db = get_db()
         
         query = """
@@ -67,106 +190,179 @@ class Expense:
         OPTIONAL MATCH (e)<-[:PARTICIPANT_IN]-(participant:User)
         OPTIONAL MATCH (e)-[:BELONGS_TO]->(g:Group)
         
-        RETURN e, paidBy, collect(DISTINCT participant) as participants, g
+        WITH e, paidBy, collect(DISTINCT participant) as participants, g
+        RETURN e, paidBy, participants, g,
+               EXISTS { (:User {id: $userId})-[:MEMBER_OF]->(g) } as isMember
         """
         
-        result = db.run(query, expenseId=expense_id)
+        result = db.read(query, expenseId=expense_id, userId=user_id)
         record = result.single()
+        check_access(record, 'Expense')
         
-        if not record:
-            return None
-        
-        expense_node = record['e']
-        paidBy = record['paidBy']
-        participants = [p for p in record['participants'] if p is not None]
-        group = record['g']
-        
-        return {
-            'id': expense_node['id'],
-            'description': expense_node['description'],
-            'amount': expense_node['amount'],
-            'createdAt': expense_node['createdAt'].isoformat() if hasattr(expense_node['createdAt'], 'isoformat') else str(expense_node['createdAt']),
-            'paidById': paidBy['id'] if paidBy else None,
-            'paidBy': {
-                'id': paidBy['id'],
-                'name': paidBy['name'],
-                'email': paidBy['email']
-            } if paidBy else None,
-            'participants': [{
-                'id': p['id'],
-                'name': p['name'],
-                'email': p['email']
-            } for p in participants],
-            'groupId': group['id'] if group else None
-        }
+        expense = expense_dict(record['e'], record['paidBy'], record['participants'], NodeRefs(USER))
+        expense['groupId'] = record['g']['id'] if record['g'] else None
+        return expense
     
     @staticmethod
-    def get_all_for_group(group_id):
-        """Get all expenses for a group"""
-        db = get_db()
+    def _page_clause(limit):
+        """
+        Cypher that keeps the expenses after a (createdAt, id) keyset cursor
+        and cuts them to one page, newest first with id as the tiebreaker
         
-        query = """
-        MATCH (g:Group {id: $groupId})<-[:BELONGS_TO]-(e:Expense)
-        OPTIONAL MATCH (e)<-[:PAID]-(paidBy:User)
-        OPTIONAL MATCH (e)<-[:PARTICIPANT_IN]-(participant:User)
+        Neo4j keeps only the top `limit` rows while sorting, so memory is one
+        page, but every expense reached before this clause is still read.
+        """
+        if limit is None:
+            return ""
+        
+        return """
+        WITH e
+        WHERE $afterCreatedAt IS NULL
+           OR e.createdAt < datetime($afterCreatedAt)
+           OR (e.createdAt = datetime($afterCreatedAt) AND e.id < $afterId)
+        WITH e
+        ORDER BY e.createdAt DESC, e.id DESC
+        LIMIT $limit
+        """
+    
+    @staticmethod
+    def _group_page_match(limit, after):
+        """
+        Cypher that finds one page of a group's expenses
         
-        WITH e, paidBy, collect(DISTINCT participant) as participants
-        RETURN e, paidBy, participants
-        ORDER BY e.createdAt DESC
+        Pages seek expense_group_created_idx (groupId, createdAt, id) from the
+        cursor and read it in order, so a page costs the same however long the
+        group's history is (test_connection.py checks the plan). Without a
+        limit every expense is reached from the group node.
         """
+        if limit is None:
+            return "MATCH (g)<-[:BELONGS_TO]-(e:Expense)"
         
-        result = db.run(query, groupId=group_id)
-        expenses = []
+        # The existence checks give the planner a predicate on every indexed property
+        cursor = """
+              AND e.createdAt <= datetime($afterCreatedAt)
+              AND (e.createdAt < datetime($afterCreatedAt) OR e.id < $afterId)""" if after else """
+              AND e.createdAt IS NOT NULL"""
         
-        for record in result:
-            expense_node = record['e']
-            paidBy = record['paidBy']
-            participants = [p for p in record['participants'] if p is not None]
+        return """MATCH (e:Expense)
+            WHERE e.groupId = $groupId%s
+              AND e.id IS NOT NULL
+            WITH e
+            ORDER BY e.createdAt DESC, e.id DESC
+            LIMIT $limit""" % cursor
+    
+    @staticmethod
+    def group_expenses_query(limit=None, after=False):
+        """Cypher for get_all_for_group (shared with the async models)"""
+        return GROUP_ACCESS + """
+        CALL {
+            WITH g, isMember
+            WITH g
+            WHERE isMember
+            %s
             
-            expenses.append({
-                'id': expense_node['id'],
-                'description': expense_node['description'],
-                'amount': expense_node['amount'],
-                'createdAt': expense_node['createdAt'].isoformat() if hasattr(expense_node['createdAt'], 'isoformat') else str(expense_node['createdAt']),
-                'paidById': paidBy['id'] if paidBy else None,
-                'paidBy': {
-                    'id': paidBy['id'],
-                    'name': paidBy['name'],
-                    'email': paidBy['email']
-                } if paidBy else None,
-                'participants': [{
-                    'id': p['id'],
-                    'name': p['name'],
-                    'email': p['email']
-                } for p in participants]
-            })
+            // Only hydrate payer and participants for the expenses on this page
+            OPTIONAL MATCH (e)<-[:PAID]-(paidBy:User)
+            OPTIONAL MATCH (e)<-[:PARTICIPANT_IN]-(participant:User)
+            
+            WITH e, paidBy, collect(DISTINCT participant) as participants
+            ORDER BY e.createdAt DESC, e.id DESC
+            RETURN collect({e: e, paidBy: paidBy, participants: participants}) as expenses
+        }
+        RETURN isMember, expenses
+        """ % Expense._group_page_match(limit, after)
+    
+    @staticmethod
+    def group_expenses_from_record(record, users=None):
+        """
+        Build the expense list from a group_expenses_query record
         
-        return expenses
+        Given `users` (a NodeRefs), expenses reference their payer and
+        participants by id and the user objects are collected there instead.
+        """
+        if users is not None:
+            return [expense_ref_dict(row['e'], row['paidBy'], row['participants'], users)
+                    for row in record['expenses']]
+        
+        users = NodeRefs(USER)
+        return [expense_dict(row['e'], row['paidBy'], row['participants'], users)
+                for row in record['expenses']]
     
     @staticmethod
-    def delete(expense_id, user_id):
-        """Delete an expense (only if user is member of the group)"""
-        db = get_db()
+    def get_all_for_group(group_id, user_id, limit=None, after=None, users=None):
+        """
+        Get expenses for a group, newest first, optionally one keyset page at a time
         
-        query = """
-        MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group)<-[:BELONGS_TO]-(e:Expense {id: $expenseId})
-        DETACH DELETE e
-        RETURN count(e) as deleted
+        Membership is checked in the same query. Raises NotFoundError or
+        ForbiddenError. Pass a NodeRefs as `users` for the normalized shape
+        (see group_expenses_from_record).
         """
+        db = get_db()
         
-        result = db.run(query, expenseId=expense_id, userId=user_id)
+        result = db.read(Expense.group_expenses_query(limit, after is not None), groupId=group_id, userId=user_id, limit=limit,
+                         afterCreatedAt=after[0] if after else None,
+                         afterId=after[1] if after else None)
         record = result.single()
-        return record['deleted'] > 0 if record else False
+        check_access(record, membership=(group_id, user_id))
+        return Expense.group_expenses_from_record(record, users)
     
     @staticmethod
-    def get_user_expenses(user_id):
-        """Get all expenses a user is involved in (paid or participated)"""
+    def delete(expense_id, user_id):
+        """
+        Delete an expense (only if user is member of the group)
+        
+        Membership is checked in the same query. Raises NotFoundError or ForbiddenError.
+        """
         db = get_db()
         
         query = """
-        MATCH (u:User {id: $userId})
-        MATCH (e:Expense)
-        WHERE (u)-[:PAID]->(e) OR (u)-[:PARTICIPANT_IN]->(e)
+        MATCH (e:Expense {id: $expenseId})-[:BELONGS_TO]->(g:Group)
+        WITH e, g, EXISTS { (:User {id: $userId})-[:MEMBER_OF]->(g) } as isMember
+        
+        CALL {
+            WITH e, g, isMember
+            WITH e, g
+            WHERE isMember
+            SET g.version = coalesce(g.version, 0) + 1,
+                g.expenseCount = coalesce(g.expenseCount, 0) - 1,
+                g.totalSpendCents = coalesce(g.totalSpendCents, 0) - e.amountCents
+            
+            // Reverse the expense's effect on the balance ledger using the stored shares
+            CALL {
+                WITH g, e
+                MATCH (e)<-[share:PARTICIPANT_IN]-(:User)-[rel:MEMBER_OF]->(g)
+                SET rel.balanceCents = coalesce(rel.balanceCents, 0) + share.shareCents
+            }
+            CALL {
+                WITH g, e
+                MATCH (e)<-[:PAID]-(:User)-[rel:MEMBER_OF]->(g)
+                WHERE EXISTS { (e)<-[:PARTICIPANT_IN]-(:User) }
+                SET rel.balanceCents = coalesce(rel.balanceCents, 0) - e.amountCents
+            }
+            
+            DETACH DELETE e
+        }
+        RETURN g.id as groupId, isMember
+        """
+        
+        result = db.write(query, expenseId=expense_id, userId=user_id)
+        record = result.single()
+        check_access(record, 'Expense')
+        
+        balance_cache.invalidate(record['groupId'])
+        return True
+    
+    @staticmethod
+    def user_expenses_query(limit=None):
+        """
+        Cypher for get_user_expenses; traverses out from the user node so the
+        cost follows the user's own expenses, pages included (test_connection.py
+        checks that its plan never falls back to scanning every Expense)
+        """
+        return """
+        MATCH (u:User {id: $userId})-[:PAID|PARTICIPANT_IN]->(e:Expense)
+        WITH DISTINCT e
+        %s
         
         OPTIONAL MATCH (e)<-[:PAID]-(paidBy:User)
         OPTIONAL MATCH (e)<-[:PARTICIPANT_IN]-(participant:User)
@@ -174,36 +370,73 @@ class Expense:
         
         WITH e, paidBy, collect(DISTINCT participant) as participants, g
         RETURN e, paidBy, participants, g
-        ORDER BY e.createdAt DESC
-        """
+        ORDER BY e.createdAt DESC, e.id DESC
+        """ % Expense._page_clause(limit)
+    
+    @staticmethod
+    def get_user_expenses(user_id, limit=None, after=None):
+        """Get expenses a user is involved in (paid or participated), optionally paginated"""
+        db = get_db()
         
-        result = db.run(query, userId=user_id)
+        result = db.read(Expense.user_expenses_query(limit), userId=user_id, limit=limit,
+                        afterCreatedAt=after[0] if after else None,
+                        afterId=after[1] if after else None)
+        users = NodeRefs(USER_REF)
+        groups = NodeRefs(GROUP)
         expenses = []
         
         for record in result:
-            expense_node = record['e']
-            paidBy = record['paidBy']
-            participants = [p for p in record['participants'] if p is not None]
-            group = record['g']
+            expense = expense_dict(record['e'], record['paidBy'], record['participants'], users)
+            expense['group'] = groups(record['g'])
+            expenses.append(expense)
+        
+        return expenses
+    
+    @staticmethod
+    def iter_user_expenses(user_id, page_size):
+        """Yield every expense a user is involved in, fetching one keyset page at a time"""
+        after = None
+        while True:
+            page = Expense.get_user_expenses(user_id, page_size, after)
+            yield from page
             
-            expenses.append({
-                'id': expense_node['id'],
-                'description': expense_node['description'],
-                'amount': expense_node['amount'],
-                'createdAt': expense_node['createdAt'].isoformat() if hasattr(expense_node['createdAt'], 'isoformat') else str(expense_node['createdAt']),
-                'paidById': paidBy['id'] if paidBy else None,
-                'paidBy': {
-                    'id': paidBy['id'],
-                    'name': paidBy['name']
-                } if paidBy else None,
-                'participants': [{
-                    'id': p['id'],
-                    'name': p['name']
-                } for p in participants],
-                'group': {
-                    'id': group['id'],
-                    'name': group['name']
-                } if group else None
+            if len(page) < page_size:
+                return
+            after = (page[-1]['createdAt'], page[-1]['id'])
+    
+    @staticmethod
+    def get_balance_totals(group_ids, tx=None):
+        """Get each member's paid and owed totals (in cents) per group, aggregated in Neo4j"""
+        
+        query = """
+        UNWIND $groupIds as groupId
+        MATCH (g:Group {id: groupId})<-[:MEMBER_OF]-(member:User)
+        
+        // Expenses without participants are not part of any balance
+        CALL {
+            WITH g, member
+            OPTIONAL MATCH (member)-[:PAID]->(e:Expense)-[:BELONGS_TO]->(g)
+            WHERE EXISTS { (e)<-[:PARTICIPANT_IN]-(:User) }
+            RETURN coalesce(sum(e.amountCents), 0) as paidCents
+        }
+        CALL {
+            WITH g, member
+            OPTIONAL MATCH (member)-[share:PARTICIPANT_IN]->(:Expense)-[:BELONGS_TO]->(g)
+            RETURN coalesce(sum(share.shareCents), 0) as owedCents
+        }
+        
+        RETURN groupId, member.id as userId, paidCents, owedCents
+        """
+        
+        # Runs inside the caller's transaction when given one
+        result = tx.run(query, groupIds=group_ids) if tx else get_db().read(query, groupIds=group_ids)
+        totals = {group_id: [] for group_id in group_ids}
+        
+        for record in result:
+            totals[record['groupId']].append({
+                'userId': record['userId'],
+                'paidCents': record['paidCents'],
+                'owedCents': record['owedCents']
             })
         
-        return expenses
\ No newline at end of file
+        return totals
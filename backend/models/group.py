@@ -1,5 +1,15 @@
 import uuid
-from database import get_db
+from database import get_db, get_identity_map
+from models.expense import Expense
+from models.settlement import Settlement
+from models.access import GROUP_ACCESS, check_access, NotFoundError
+from utils.cache import balance_cache
+from utils.calculations import calculate_balances_from_totals
+from utils.money import to_cents, from_cents
+from utils.serializers import GROUP, USER, NodeRefs, normalize_group
+
+# Bump whenever the shape of the balance ledger changes so stale ledgers get rebuilt
+LEDGER_VERSION = 2
 
 class Group:
     @staticmethod
@@ -13,25 +23,25 @@ class Group:
         CREATE (g:Group {
             id: $groupId,
             name: $name,
+            ledgerVersion: $ledgerVersion,
+            version: 0,
+            memberCount: 1,
+            expenseCount: 0,
+            totalSpendCents: 0,
             createdAt: datetime()
         })
-        CREATE (u)-[:MEMBER_OF]->(g)
+        CREATE (u)-[:MEMBER_OF {balanceCents: 0}]->(g)
         RETURN g
         """
         
-        result = db.run(query, 
+        result = db.write(query, 
                        groupId=group_id,
                        name=name,
-                       creatorId=creator_id)
+                       creatorId=creator_id,
+                       ledgerVersion=LEDGER_VERSION)
         
         record = result.single()
-        if record:
-            group_node = record['g']
-            return {
-                'id': group_node['id'],
-                'name': group_node['name']
-            }
-        return None
+        return GROUP(record['g']) if record else None
     
     @staticmethod
     def find_by_id(group_id, user_id=None):
@@ -43,158 +53,417 @@ class Group:
             MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group {id: $groupId})
             RETURN g
             """
-            result = db.run(query, groupId=group_id, userId=user_id)
+            result = db.read(query, groupId=group_id, userId=user_id)
         else:
             query = """
             MATCH (g:Group {id: $groupId})
             RETURN g
             """
-            result = db.run(query, groupId=group_id)
+            result = db.read(query, groupId=group_id)
         
         record = result.single()
-        if record:
-            group_node = record['g']
-            return {
-                'id': group_node['id'],
-                'name': group_node['name']
-            }
-        return None
+        return GROUP(record['g']) if record else None
+    
+    @staticmethod
+    def summary_query():
+        """Cypher for get_summary (shared with the async models)"""
+        return GROUP_ACCESS + """
+        // Subqueries keep members and counts from multiplying each other's rows
+        CALL {
+            WITH g
+            MATCH (g)<-[:MEMBER_OF]-(member:User)
+            RETURN collect({
+                id: member.id,
+                name: member.name,
+                email: member.email
+            }) as members
+        }
+        
+        RETURN g, isMember, members,
+               COUNT { (g)<-[:IN_GROUP]-(:Settlement) } as settlementCount
+        """
     
     @staticmethod
-    def get_with_details(group_id, user_id):
-        """Get group with members and expenses"""
+    def summary_from_record(record):
+        """Build the summary dict from a summary_query record"""
+        group_node = record['g']
+        members = record['members']
+        
+        group = GROUP(group_node)
+        group['members'] = members
+        group['totalSpend'] = from_cents(group_node['totalSpendCents'] or 0)
+        group['_count'] = {
+            'members': len(members),
+            'expenses': group_node['expenseCount'] or 0,
+            'settlements': record['settlementCount']
+        }
+        return group
+    
+    @staticmethod
+    def get_summary(group_id, user_id):
+        """
+        Get group metadata, members and counts without touching the expense history
+        
+        Raises NotFoundError or ForbiddenError.
+        """
         db = get_db()
         
-        query = """
-        MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group {id: $groupId})
+        result = db.read(Group.summary_query(), groupId=group_id, userId=user_id)
+        record = result.single()
+        check_access(record, membership=(group_id, user_id))
+        group = Group.summary_from_record(record)
         
-        // Collect members first
-        OPTIONAL MATCH (g)<-[:MEMBER_OF]-(member:User)
-        WITH g, collect(DISTINCT {
-            id: member.id, 
-            name: member.name, 
-            email: member.email
-        }) as members
+        # Later lookups in this request can reuse the members
+        identity = get_identity_map()
+        for member in group['members']:
+            identity.users.setdefault(member['id'], member)
+            identity.memberships[(group_id, member['id'])] = True
+        
+        return group
+    
+    @staticmethod
+    def get_with_details(group_id, user_id, normalized=False):
+        """
+        Get group with members and all of its expenses
         
-        // Find all expenses for the group
-        OPTIONAL MATCH (g)<-[:BELONGS_TO]-(expense:Expense)
+        normalized=True returns each user once in a top-level users map, with
+        memberIds and expenses referencing them by id.
+        """
+        group = Group.get_summary(group_id, user_id)
         
-        // For each expense, find the payer and participants
-        OPTIONAL MATCH (expense)<-[:PAID]-(paidBy:User)
-        OPTIONAL MATCH (expense)<-[:PARTICIPANT_IN]-(participant:User)
+        # Expenses come from their own query, newest first
+        if normalized:
+            users = NodeRefs(USER)
+            group['expenses'] = Expense.get_all_for_group(group_id, user_id, users=users)
+            return normalize_group(group, users)
         
-        // Pre-aggregate participants for EACH expense
-        WITH g, members, expense, paidBy, collect(DISTINCT participant) as participants
+        group['expenses'] = Expense.get_all_for_group(group_id, user_id)
+        return group
+    
+    @staticmethod
+    def get_balances(group_id, user_id):
+        """Get the net balance of every member, in cents, from the group's ledger"""
+        db = get_db()
         
-        // Now, collect all expense data (this is NOT nested)
-        WITH g, members, collect(DISTINCT {
-            expense: expense,
-            paidBy: paidBy,
-            participants: participants
-        }) as expenseData
+        # Skip re-matching the membership when this request already verified it
+        if get_identity_map().memberships.get((group_id, user_id)):
+            access = """
+        MATCH (g:Group {id: $groupId})"""
+        else:
+            access = """
+        MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group {id: $groupId})"""
         
-        RETURN g, members, expenseData
+        query = access + """
+        MATCH (g)<-[rel:MEMBER_OF]-(member:User)
+        RETURN g.ledgerVersion as ledgerVersion,
+               collect({id: member.id, balance: rel.balanceCents}) as balances
         """
         
-        result = db.run(query, groupId=group_id, userId=user_id)
+        result = db.read(query, groupId=group_id, userId=user_id)
         record = result.single()
         
         if not record:
             return None
         
-        group_node = record['g']
-        members = [m for m in record['members'] if m['id'] is not None]
-        
-        expenses = []
-        for exp_data in record['expenseData']:
-            expense = exp_data['expense']
-            if expense is None:
-                continue
-                
-            paidBy = exp_data['paidBy']
-            participants = [p for p in exp_data['participants'] if p is not None]
-            
-            expenses.append({
-                'id': expense['id'],
-                'description': expense['description'],
-                'amount': expense['amount'],
-                'createdAt': expense['createdAt'].isoformat() if hasattr(expense['createdAt'], 'isoformat') else str(expense['createdAt']),
-                'paidById': paidBy['id'] if paidBy else None,
-                'paidBy': {
-                    'id': paidBy['id'],
-                    'name': paidBy['name'],
-                    'email': paidBy['email']
-                } if paidBy else None,
-                'participants': [{
-                    'id': p['id'],
-                    'name': p['name'],
-                    'email': p['email']
-                } for p in participants]
-            })
-        
-        expenses.sort(key=lambda x: x['createdAt'], reverse=True)
+        # Groups created before the ledger existed are replayed once from history
+        if record['ledgerVersion'] != LEDGER_VERSION:
+            return Group.rebuild_ledger(group_id)
+        
+        return {b['id']: b['balance'] or 0 for b in record['balances']}
+    
+    @staticmethod
+    def balances_for_user_query():
+        """Cypher for get_balances_for_user (shared with the async models)"""
+        return """
+        MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group)
+        MATCH (g)<-[rel:MEMBER_OF]-(member:User)
+        RETURN g, collect({id: member.id, balance: rel.balanceCents}) as balances
+        ORDER BY g.name
+        """
+    
+    @staticmethod
+    def ledger_from_record(record):
+        """
+        Build a {id, name, version, balances, stale} dict from a record with g and balances
         
+        stale is True when the stored ledger predates LEDGER_VERSION and must be rebuilt.
+        """
+        group_node = record['g']
         return {
             'id': group_node['id'],
             'name': group_node['name'],
-            'members': members,
-            'expenses': expenses
+            'version': group_node.get('version', 0),
+            'balances': {b['id']: b['balance'] or 0 for b in record['balances']},
+            'stale': group_node.get('ledgerVersion') != LEDGER_VERSION
         }
     
     @staticmethod
-    def add_member(group_id, user_email, current_user_id):
-        """Add a new member to the group"""
+    def get_balances_for_user(user_id):
+        """Get the ledger balances (in cents) of every group a user belongs to in one query"""
         db = get_db()
         
-        query = """
-        MATCH (currentUser:User {id: $currentUserId})-[:MEMBER_OF]->(g:Group {id: $groupId})
-        MATCH (newUser:User {email: $userEmail})
-        OPTIONAL MATCH (newUser)-[existingRel:MEMBER_OF]->(g)
-        WITH g, newUser, existingRel
-        WHERE existingRel IS NULL
-        CREATE (newUser)-[:MEMBER_OF]->(g)
-        RETURN newUser
-        """
+        result = db.read(Group.balances_for_user_query(), userId=user_id)
+        groups = [Group.ledger_from_record(record) for record in result]
+        stale_ids = [group['id'] for group in groups if group.pop('stale')]
         
-        result = db.run(query, 
-                       groupId=group_id,
-                       userEmail=user_email,
-                       currentUserId=current_user_id)
+        if stale_ids:
+            rebuilt = Group.rebuild_ledgers(stale_ids)
+            for group in groups:
+                if group['id'] in rebuilt:
+                    group['balances'] = rebuilt[group['id']]
+        
+        return groups
+    
+    @staticmethod
+    def get_version(group_id, user_id):
+        """Get a group's version counter; raises NotFoundError or ForbiddenError"""
+        db = get_db()
+        
+        query = GROUP_ACCESS + """
+        RETURN isMember, coalesce(g.version, 0) as version
+        """
         
+        result = db.read(query, groupId=group_id, userId=user_id)
         record = result.single()
-        return record is not None
+        check_access(record, membership=(group_id, user_id))
+        return record['version']
     
     @staticmethod
-    def is_member(group_id, user_id):
-        """Check if user is a member of the group"""
+    def get_versions_for_user(user_id):
+        """Get the version counter of every group a user belongs to"""
         db = get_db()
         
         query = """
-        MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group {id: $groupId})
-        RETURN count(u) > 0 as isMember
+        MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group)
+        RETURN g.id as id, coalesce(g.version, 0) as version
         """
         
-        result = db.run(query, groupId=group_id, userId=user_id)
+        result = db.read(query, userId=user_id)
+        return {record['id']: record['version'] for record in result}
+    
+    @staticmethod
+    def backfill_amount_cents(tx, group_ids=None):
+        """
+        Set amountCents on expenses and settlements written before amounts were stored in cents
+        
+        The conversion runs in Python with to_cents, so stored floats round
+        exactly like new amounts (Decimal, half up) instead of through
+        Cypher's float round().
+        
+        Args:
+            tx: Transaction or session to run in
+            group_ids: Groups to backfill (all groups if None)
+        """
+        result = tx.run("""
+        MATCH (g:Group)<-[:BELONGS_TO|IN_GROUP]-(n)
+        WHERE ($groupIds IS NULL OR g.id IN $groupIds)
+          AND n.amountCents IS NULL AND n.amount IS NOT NULL
+        RETURN elementId(n) as nodeId, n.amount as amount
+        """, groupIds=group_ids)
+        rows = [{'nodeId': record['nodeId'], 'amountCents': to_cents(record['amount'])} for record in result]
+        
+        if rows:
+            tx.run("""
+            UNWIND $rows as row
+            MATCH (n) WHERE elementId(n) = row.nodeId
+            SET n.amountCents = row.amountCents
+            """, rows=rows).consume()
+    
+    @staticmethod
+    def rebuild_ledger(group_id):
+        """Recompute the balance ledger of a group from all its expenses and settlements"""
+        return Group.rebuild_ledgers([group_id]).get(group_id, {})
+    
+    @staticmethod
+    def rebuild_ledgers(group_ids, tx=None):
+        """
+        Recompute the balance ledgers of several groups in one transaction
+        
+        Runs in tx when given, so callers without a request (the ASGI app)
+        can supply their own session's transaction.
+        """
+        # A managed transaction may be retried, so all state starts inside it
+        def rebuild(tx):
+            members = {group_id: [] for group_id in group_ids}
+            
+            # Touch every membership first: expense and settlement writes update these
+            # relationships, so they queue behind the rebuild instead of being lost
+            result = tx.run("""
+            UNWIND $groupIds as groupId
+            MATCH (g:Group {id: groupId})<-[rel:MEMBER_OF]-(member:User)
+            SET rel.balanceCents = coalesce(rel.balanceCents, 0)
+            RETURN groupId, member.id as id
+            """, groupIds=group_ids)
+            for record in result:
+                members[record['groupId']].append({'id': record['id']})
+            
+            Group.backfill_amount_cents(tx, group_ids)
+            tx.run("""
+            UNWIND $groupIds as groupId
+            MATCH (g:Group {id: groupId})<-[:BELONGS_TO]-(e:Expense)
+            WHERE EXISTS { (e)<-[share:PARTICIPANT_IN]-(:User) WHERE share.shareCents IS NULL }
+            MATCH (e)<-[share:PARTICIPANT_IN]-(participant:User)
+            WITH e, share
+            ORDER BY participant.id
+            WITH e, collect(share) as shares
+            UNWIND range(0, size(shares) - 1) as i
+            WITH e, shares[i] as share, i, size(shares) as n
+            SET share.shareCents = e.amountCents / n + CASE WHEN i < e.amountCents % n THEN 1 ELSE 0 END
+            """, groupIds=group_ids)
+            
+            # Let Neo4j sum the history down to O(members) rows per group
+            totals = Expense.get_balance_totals(group_ids, tx=tx)
+            flows = Settlement.get_flows(group_ids, tx=tx)
+            
+            ledgers = {
+                group_id: calculate_balances_from_totals(members[group_id], totals[group_id], flows[group_id])
+                for group_id in group_ids
+                if members[group_id]
+            }
+            
+            tx.run("""
+            UNWIND $ledgers as ledger
+            MATCH (g:Group {id: ledger.groupId})
+            SET g.ledgerVersion = $ledgerVersion
+            WITH g, ledger
+            UNWIND ledger.balances as entry
+            MATCH (:User {id: entry.id})-[rel:MEMBER_OF]->(g)
+            SET rel.balanceCents = entry.balance
+            REMOVE rel.balance
+            """,
+                   ledgerVersion=LEDGER_VERSION,
+                   ledgers=[{
+                       'groupId': group_id,
+                       'balances': [{'id': k, 'balance': v} for k, v in balances.items()]
+                   } for group_id, balances in ledgers.items()])
+            return ledgers
+        
+        return rebuild(tx) if tx else get_db().write_transaction(rebuild)
+    
+    @staticmethod
+    def repair_counters(group_ids=None, only_missing=False, tx=None):
+        """
+        Recompute memberCount, expenseCount and totalSpendCents from scratch
+        
+        The counters are kept up to date by the writes that change them; this
+        rebuilds them after imports, manual edits or for groups created before
+        they existed.
+        
+        Args:
+            group_ids: Groups to repair (all groups if None)
+            only_missing: Only touch groups that have no counters yet
+            tx: Transaction or session to run in (a new write if omitted)
+        
+        Returns:
+            dict: {groups: groups checked, repaired: groups whose counters were wrong}
+        """
+        query = """
+        MATCH (g:Group)
+        WHERE ($groupIds IS NULL OR g.id IN $groupIds)
+          AND (NOT $onlyMissing OR g.memberCount IS NULL)
+        CALL {
+            WITH g
+            OPTIONAL MATCH (g)<-[:BELONGS_TO]-(e:Expense)
+            RETURN count(e) as expenseCount, sum(e.amountCents) as totalSpendCents
+        }
+        WITH g, expenseCount, totalSpendCents,
+             COUNT { (g)<-[:MEMBER_OF]-(:User) } as memberCount
+        WITH g, memberCount, expenseCount, totalSpendCents,
+             NOT coalesce(g.memberCount = memberCount
+                          AND g.expenseCount = expenseCount
+                          AND g.totalSpendCents = totalSpendCents, false) as drifted
+        SET g.memberCount = memberCount,
+            g.expenseCount = expenseCount,
+            g.totalSpendCents = totalSpendCents
+        RETURN count(g) as groups, sum(CASE WHEN drifted THEN 1 ELSE 0 END) as repaired
+        """
+        
+        # Legacy expenses need amountCents before they can be summed
+        def repair(tx):
+            Group.backfill_amount_cents(tx, group_ids)
+            return tx.run(query, groupIds=group_ids, onlyMissing=only_missing).single()
+        
+        # Runs inside the caller's transaction when given one
+        record = repair(tx) if tx else get_db().write_transaction(repair)
+        
+        for group_id in group_ids or []:
+            balance_cache.invalidate(group_id)
+        
+        return {'groups': record['groups'], 'repaired': record['repaired'] or 0}
+    
+    @staticmethod
+    def add_member(group_id, user_email, current_user_id):
+        """
+        Add a new member to the group
+        
+        Membership of the current user is checked in the same query. Raises
+        NotFoundError or ForbiddenError, and returns False if the user is
+        already a member.
+        """
+        db = get_db()
+        
+        query = GROUP_ACCESS + """
+        OPTIONAL MATCH (newUser:User {email: $userEmail})
+        WITH g, isMember, newUser,
+             newUser IS NOT NULL AND EXISTS { (newUser)-[:MEMBER_OF]->(g) } as alreadyMember
+        
+        CALL {
+            WITH g, isMember, newUser, alreadyMember
+            WITH g, newUser
+            WHERE isMember AND newUser IS NOT NULL AND NOT alreadyMember
+            CREATE (newUser)-[:MEMBER_OF {balanceCents: 0}]->(g)
+            SET g.version = coalesce(g.version, 0) + 1,
+                g.memberCount = coalesce(g.memberCount, 0) + 1
+        }
+        RETURN isMember, newUser IS NOT NULL as userExists, alreadyMember
+        """
+        
+        result = db.write(query, 
+                       groupId=group_id,
+                       userEmail=user_email,
+                       userId=current_user_id)
+        
         record = result.single()
-        return record['isMember'] if record else False
+        check_access(record)
+        
+        if not record['userExists']:
+            raise NotFoundError("User with that email not found.")
+        if record['alreadyMember']:
+            return False
+        
+        get_identity_map().forget_group(group_id)
+        balance_cache.invalidate(group_id)
+        return True
     
     @staticmethod
     def delete(group_id, user_id):
-        """Delete a group and all related data"""
+        """
+        Delete a group and all related data
+        
+        Membership is checked in the same query. Raises NotFoundError or ForbiddenError.
+        """
         db = get_db()
         
-        query = """
-        MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group {id: $groupId})
-        OPTIONAL MATCH (g)<-[:IN_GROUP]-(s:Settlement)
-        DETACH DELETE s
-        WITH g
-        OPTIONAL MATCH (g)<-[:BELONGS_TO]-(e:Expense)
-        DETACH DELETE e
-        WITH g
-        DETACH DELETE g
-        RETURN count(g) as deleted
-        """
-        
-        result = db.run(query, groupId=group_id, userId=user_id)
+        query = GROUP_ACCESS + """
+        CALL {
+            WITH g, isMember
+            WITH g
+            WHERE isMember
+            OPTIONAL MATCH (g)<-[:IN_GROUP]-(s:Settlement)
+            DETACH DELETE s
+            WITH DISTINCT g
+            OPTIONAL MATCH (g)<-[:BELONGS_TO]-(e:Expense)
+            DETACH DELETE e
+            WITH DISTINCT g
+            DETACH DELETE g
+        }
+        RETURN isMember
+        """
+        
+        result = db.write(query, groupId=group_id, userId=user_id)
         record = result.single()
-        return record['deleted'] > 0 if record else False
+        check_access(record)
+        
+        get_identity_map().forget_group(group_id)
+        balance_cache.invalidate(group_id)
+        return True
@@ -1,92 +1,108 @@
 import uuid
 from database import get_db
-from datetime import datetime
+from models.access import GROUP_ACCESS, check_access
+from utils.cache import balance_cache
+from utils.money import to_cents, from_cents
+from utils.serializers import USER_REF, NodeRefs, settlement_dict
 
 class Settlement:
     @staticmethod
     def create(group_id, from_user_id, to_user_id, amount):
-        """Record a settlement payment between two users in a group"""
+        """
+        Record a settlement payment between two users in a group (amount is converted to integer cents)
+        
+        Membership of the payer is checked in the same query. Raises
+        NotFoundError or ForbiddenError, and returns None if the recipient is
+        not a member.
+        """
         db = get_db()
         settlement_id = str(uuid.uuid4())
+        amount_cents = to_cents(amount)
         
-        query = """
-        // Verify both users are members of the group
-        MATCH (fromUser:User {id: $fromUserId})-[:MEMBER_OF]->(g:Group {id: $groupId})
-        MATCH (toUser:User {id: $toUserId})-[:MEMBER_OF]->(g)
-        
-        // Create settlement node
-        CREATE (s:Settlement {
-            id: $settlementId,
-            amount: $amount,
-            paidAt: datetime()
-        })
-        
-        // Link settlement to group and users
-        CREATE (s)-[:IN_GROUP]->(g)
-        CREATE (s)-[:FROM]->(fromUser)
-        CREATE (s)-[:TO]->(toUser)
+        query = GROUP_ACCESS + """
+        // The payer is the current user; the recipient must be a member too
+        OPTIONAL MATCH (toUser:User {id: $toUserId})-[toRel:MEMBER_OF]->(g)
         
-        RETURN s
+        CALL {
+            WITH g, u, access, isMember, toUser, toRel
+            WITH g, u as fromUser, access as fromRel, toUser, toRel
+            WHERE isMember AND toRel IS NOT NULL
+            
+            // Create settlement node
+            CREATE (s:Settlement {
+                id: $settlementId,
+                amount: $amount,
+                amountCents: $amountCents,
+                paidAt: datetime()
+            })
+            
+            // Link settlement to group and users
+            CREATE (s)-[:IN_GROUP]->(g)
+            CREATE (s)-[:FROM]->(fromUser)
+            CREATE (s)-[:TO]->(toUser)
+            SET g.version = coalesce(g.version, 0) + 1
+            
+            // Apply the payment to the balance ledger in the same transaction
+            SET fromRel.balanceCents = coalesce(fromRel.balanceCents, 0) + s.amountCents
+            SET toRel.balanceCents = coalesce(toRel.balanceCents, 0) - s.amountCents
+            
+            RETURN collect(s) as created
+        }
+        RETURN isMember, created
         """
         
-        result = db.run(query,
+        result = db.write(query,
                        settlementId=settlement_id,
                        groupId=group_id,
-                       fromUserId=from_user_id,
+                       userId=from_user_id,
                        toUserId=to_user_id,
-                       amount=float(amount))
+                       amount=from_cents(amount_cents),
+                       amountCents=amount_cents)
         
         record = result.single()
-        if record:
-            settlement_node = record['s']
-            return {
-                'id': settlement_node['id'],
-                'amount': settlement_node['amount'],
-                'paidAt': settlement_node['paidAt'].isoformat() if hasattr(settlement_node['paidAt'], 'isoformat') else str(settlement_node['paidAt']),
-                'groupId': group_id,
-                'fromUserId': from_user_id,
-                'toUserId': to_user_id
-            }
+        check_access(record, membership=(group_id, from_user_id))
+        
+        if record['created']:
+            balance_cache.invalidate(group_id)
+            return settlement_dict(record['created'][0], group_id, from_user_id, to_user_id)
         return None
     
     @staticmethod
-    def get_for_group(group_id):
-        """Get all settlements for a group"""
-        db = get_db()
+    def get_for_group(group_id, user_id):
+        """
+        Get all settlements for a group
         
-        query = """
-        MATCH (s:Settlement)-[:IN_GROUP]->(g:Group {id: $groupId})
-        MATCH (s)-[:FROM]->(fromUser:User)
-        MATCH (s)-[:TO]->(toUser:User)
+        Membership is checked in the same query. Raises NotFoundError or ForbiddenError.
+        """
+        db = get_db()
         
-        RETURN s, fromUser, toUser
-        ORDER BY s.paidAt DESC
+        query = GROUP_ACCESS + """
+        CALL {
+            WITH g, isMember
+            WITH g
+            WHERE isMember
+            MATCH (s:Settlement)-[:IN_GROUP]->(g)
+            MATCH (s)-[:FROM]->(fromUser:User)
+            MATCH (s)-[:TO]->(toUser:User)
+            
+            WITH s, fromUser, toUser
+            ORDER BY s.paidAt DESC
+            RETURN collect({s: s, fromUser: fromUser, toUser: toUser}) as settlements
+        }
+        RETURN isMember, settlements
         """
         
-        result = db.run(query, groupId=group_id)
+        result = db.read(query, groupId=group_id, userId=user_id)
+        record = result.single()
+        check_access(record, membership=(group_id, user_id))
+        users = NodeRefs(USER_REF)
         settlements = []
         
-        for record in result:
-            settlement_node = record['s']
-            from_user = record['fromUser']
-            to_user = record['toUser']
-            
-            settlements.append({
-                'id': settlement_node['id'],
-                'amount': settlement_node['amount'],
-                'paidAt': settlement_node['paidAt'].isoformat() if hasattr(settlement_node['paidAt'], 'isoformat') else str(settlement_node['paidAt']),
-                'groupId': group_id,
-                'fromUserId': from_user['id'],
-                'fromUser': {
-                    'id': from_user['id'],
-                    'name': from_user['name']
-                },
-                'toUserId': to_user['id'],
-                'toUser': {
-                    'id': to_user['id'],
-                    'name': to_user['name']
-                }
-            })
+        for row in record['settlements']:
+            settlement = settlement_dict(row['s'], group_id, row['fromUser']['id'], row['toUser']['id'])
+            settlement['fromUser'] = users(row['fromUser'])
+            settlement['toUser'] = users(row['toUser'])
+            settlements.append(settlement)
         
         return settlements
     
@@ -104,23 +120,12 @@ class Settlement:
         ORDER BY s.paidAt DESC
         """
         
-        result = db.run(query, 
+        result = db.read(query, 
                        groupId=group_id,
                        fromUserId=from_user_id,
                        toUserId=to_user_id)
         
-        settlements = []
-        for record in result:
-            settlement_node = record['s']
-            settlements.append({
-                'id': settlement_node['id'],
-                'amount': settlement_node['amount'],
-                'paidAt': settlement_node['paidAt'].isoformat() if hasattr(settlement_node['paidAt'], 'isoformat') else str(settlement_node['paidAt']),
-                'fromUserId': from_user_id,
-                'toUserId': to_user_id
-            })
-        
-        return settlements
+        return [settlement_dict(record['s'], group_id, from_user_id, to_user_id) for record in result]
     
     @staticmethod
     def get_total_paid(group_id, from_user_id, to_user_id):
@@ -132,16 +137,16 @@ class Settlement:
         MATCH (s)-[:FROM]->(:User {id: $fromUserId})
         MATCH (s)-[:TO]->(:User {id: $toUserId})
         
-        RETURN COALESCE(sum(s.amount), 0) as totalPaid
+        RETURN COALESCE(sum(s.amountCents), 0) as totalPaidCents
         """
         
-        result = db.run(query,
+        result = db.read(query,
                        groupId=group_id,
                        fromUserId=from_user_id,
                        toUserId=to_user_id)
         
         record = result.single()
-        return record['totalPaid'] if record else 0.0
+        return from_cents(record['totalPaidCents']) if record else 0.0
     
     @staticmethod
     def delete_for_group(group_id):
@@ -154,6 +159,32 @@ class Settlement:
         RETURN count(s) as deleted
         """
         
-        result = db.run(query, groupId=group_id)
+        result = db.write(query, groupId=group_id)
         record = result.single()
-        return record['deleted'] if record else 0
\ No newline at end of file
+        return record['deleted'] if record else 0
+    
+    @staticmethod
+    def get_flows(group_ids, tx=None):
+        """Get the total amount (in cents) paid between each pair of users per group"""
+        
+        query = """
+        UNWIND $groupIds as groupId
+        MATCH (s:Settlement)-[:IN_GROUP]->(g:Group {id: groupId})
+        MATCH (s)-[:FROM]->(fromUser:User)
+        MATCH (s)-[:TO]->(toUser:User)
+        
+        RETURN groupId, fromUser.id as fromUserId, toUser.id as toUserId, sum(s.amountCents) as amountCents
+        """
+        
+        # Runs inside the caller's transaction when given one
+        result = tx.run(query, groupIds=group_ids) if tx else get_db().read(query, groupIds=group_ids)
+        flows = {group_id: [] for group_id in group_ids}
+        
+        for record in result:
+            flows[record['groupId']].append({
+                'fromUserId': record['fromUserId'],
+                'toUserId': record['toUserId'],
+                'amountCents': record['amountCents']
+            })
+        
+        return flows
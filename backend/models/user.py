@@ -1,39 +1,39 @@
 import uuid
-from database import get_db
+from database import get_db, get_identity_map
+from utils.money import from_cents
+from utils.serializers import GROUP, USER, profile_dict
 
 class User:
     @staticmethod
     def create(email, name, hashed_password):
-        """Create a new user node in Neo4j"""
+        """
+        Create a new user node in Neo4j, or return None if the email is taken
+        
+        The existence check and the create are one MERGE on the unique email,
+        so a signup that loses a race for the email gets None, not a duplicate.
+        """
         db = get_db()
         user_id = str(uuid.uuid4())
         
         query = """
-        CREATE (u:User {
-            id: $id,
-            email: $email,
-            name: $name,
-            hashedPassword: $hashedPassword,
-            createdAt: datetime()
-        })
+        MERGE (u:User {email: $email})
+        ON CREATE SET u.id = $id,
+                      u.name = $name,
+                      u.hashedPassword = $hashedPassword,
+                      u.createdAt = datetime()
+        WITH u
+        WHERE u.id = $id
         RETURN u
         """
         
-        result = db.run(query, 
+        result = db.write(query, 
                        id=user_id, 
                        email=email, 
                        name=name, 
                        hashedPassword=hashed_password)
         
         record = result.single()
-        if record:
-            user_node = record['u']
-            return {
-                'id': user_node['id'],
-                'email': user_node['email'],
-                'name': user_node['name']
-            }
-        return None
+        return USER(record['u']) if record else None
     
     @staticmethod
     def find_by_email(email):
@@ -45,22 +45,84 @@ class User:
         RETURN u
         """
         
-        result = db.run(query, email=email)
+        result = db.read(query, email=email)
         record = result.single()
         
         if record:
-            user_node = record['u']
-            return {
-                'id': user_node['id'],
-                'email': user_node['email'],
-                'name': user_node['name'],
-                'hashedPassword': user_node.get('hashedPassword')
-            }
+            user = profile_dict(record['u'])
+            user['hashedPassword'] = record['u']['hashedPassword']
+            return user
         return None
     
+    @staticmethod
+    def get_profile(user_id):
+        """Get a user's id, email, name and profileVersion (what access tokens sign), or None"""
+        db = get_db()
+        
+        query = """
+        MATCH (u:User {id: $userId})
+        RETURN u
+        """
+        
+        result = db.read(query, userId=user_id)
+        record = result.single()
+        
+        return profile_dict(record['u']) if record else None
+    
+    @staticmethod
+    def update_profile(user_id, name):
+        """
+        Change a user's name and bump their profileVersion
+        
+        Access tokens signed with the old version stop being accepted by this
+        process once the caller passes the new version to
+        utils.auth.profile_changed; elsewhere they last until they expire.
+        
+        Returns:
+            dict: The updated profile, or None if the user does not exist
+        """
+        db = get_db()
+        
+        query = """
+        MATCH (u:User {id: $userId})
+        SET u.name = $name,
+            u.profileVersion = coalesce(u.profileVersion, 0) + 1
+        RETURN u
+        """
+        
+        result = db.write(query, userId=user_id, name=name)
+        record = result.single()
+        get_identity_map().users.pop(user_id, None)
+        
+        return profile_dict(record['u']) if record else None
+    
+    @staticmethod
+    def update_password_hash(user_id, old_hash, new_hash):
+        """
+        Replace a user's password hash, unless it changed since old_hash was read
+        
+        Returns:
+            bool: True if the hash was replaced
+        """
+        db = get_db()
+        
+        query = """
+        MATCH (u:User {id: $userId})
+        WHERE u.hashedPassword = $oldHash
+        SET u.hashedPassword = $newHash
+        RETURN u.id as id
+        """
+        
+        result = db.write(query, userId=user_id, oldHash=old_hash, newHash=new_hash)
+        return result.single() is not None
+    
     @staticmethod
     def find_by_id(user_id):
-        """Find user by ID"""
+        """Find user by ID (memoized for the rest of the request)"""
+        identity = get_identity_map()
+        if user_id in identity.users:
+            return identity.users[user_id]
+        
         db = get_db()
         
         query = """
@@ -68,17 +130,10 @@ class User:
         RETURN u
         """
         
-        result = db.run(query, id=user_id)
+        result = db.read(query, id=user_id)
         record = result.single()
-        
-        if record:
-            user_node = record['u']
-            return {
-                'id': user_node['id'],
-                'email': user_node['email'],
-                'name': user_node['name']
-            }
-        return None
+        identity.users[user_id] = USER(record['u']) if record else None
+        return identity.users[user_id]
     
     @staticmethod
     def exists_by_email(email):
@@ -90,7 +145,7 @@ class User:
         RETURN count(u) > 0 as exists
         """
         
-        result = db.run(query, email=email)
+        result = db.read(query, email=email)
         record = result.single()
         return record['exists'] if record else False
     
@@ -105,43 +160,31 @@ class User:
         ORDER BY u.name
         """
         
-        result = db.run(query)
-        users = []
-        
-        for record in result:
-            user_node = record['u']
-            users.append({
-                'id': user_node['id'],
-                'email': user_node['email'],
-                'name': user_node['name']
-            })
-        
-        return users
+        result = db.read(query)
+        return [USER(record['u']) for record in result]
     
     @staticmethod
     def get_groups(user_id):
-        """Get all groups a user is a member of"""
+        """Get all groups a user is a member of, with the counters stored on each group"""
         db = get_db()
         
         query = """
         MATCH (u:User {id: $userId})-[:MEMBER_OF]->(g:Group)
-        OPTIONAL MATCH (g)<-[:MEMBER_OF]-(member:User)
-        WITH g, count(DISTINCT member) as memberCount
-        RETURN g, memberCount
+        RETURN g
         ORDER BY g.name
         """
         
-        result = db.run(query, userId=user_id)
+        result = db.read(query, userId=user_id)
         groups = []
         
         for record in result:
             group_node = record['g']
-            groups.append({
-                'id': group_node['id'],
-                'name': group_node['name'],
-                '_count': {
-                    'members': record['memberCount']
-                }
-            })
+            group = GROUP(group_node)
+            group['totalSpend'] = from_cents(group_node['totalSpendCents'] or 0)
+            group['_count'] = {
+                'members': group_node['memberCount'] or 0,
+                'expenses': group_node['expenseCount'] or 0
+            }
+            groups.append(group)
         
         return groups
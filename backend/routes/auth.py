@@ -1,7 +1,9 @@
 from flask import Blueprint, request, jsonify
 import re
 from models.user import User
-from utils.auth import hash_password, verify_password, generate_token
+from utils.auth import (hash_password, verify_password, needs_rehash, generate_token_pair,
+                        decode_claims, claims_user, get_current_claims, profile_changed,
+                        require_auth, PasswordHasherBusy)
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -10,6 +12,12 @@ def validate_email(email):
     pattern = r'^[^\s@]+@[^\s@]+\.[^\s@]+$'
     return re.match(pattern, email) is not None
 
+def busy_response(e):
+    """429 for a login or registration turned away by the password hasher"""
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
 def validate_password(password):
     """Validate password complexity"""
     if len(password) < 8:
@@ -41,6 +49,8 @@ def register():
         if not is_valid:
             return jsonify({"error": error_msg}), 400
         
+        # A cheap read turns duplicates away before they take a slot in the bcrypt pool;
+        # the MERGE in User.create still settles two signups racing for one email
         if User.exists_by_email(email):
             return jsonify({"error": "User with this email already exists."}), 409
         
@@ -48,7 +58,7 @@ def register():
         user = User.create(email, name, hashed_password)
         
         if not user:
-            return jsonify({"error": "Failed to create user"}), 500
+            return jsonify({"error": "User with this email already exists."}), 409
         
         return jsonify({
             "message": "User created successfully",
@@ -59,6 +69,8 @@ def register():
             }
         }), 201
         
+    except PasswordHasherBusy as e:
+        return busy_response(e)
     except Exception as e:
         print(f"Registration error: {e}")
         return jsonify({"error": "Internal Server Error"}), 500
@@ -81,10 +93,16 @@ def login():
         if not verify_password(password, user['hashedPassword']):
             return jsonify({"error": "Invalid credentials"}), 401
         
-        token = generate_token(user['id'])
+        # Upgrade hashes made with a different BCRYPT_ROUNDS while we have the password;
+        # under load this waits for a later login
+        if needs_rehash(user['hashedPassword']):
+            try:
+                User.update_password_hash(user['id'], user['hashedPassword'], hash_password(password))
+            except PasswordHasherBusy:
+                pass
         
         return jsonify({
-            "token": token,
+            **generate_token_pair(user),
             "user": {
                 "id": user['id'],
                 "email": user['email'],
@@ -92,21 +110,22 @@ def login():
             }
         }), 200
         
+    except PasswordHasherBusy as e:
+        return busy_response(e)
     except Exception as e:
         print(f"Login error: {e}")
         return jsonify({"error": "Internal Server Error"}), 500
 
 @auth_bp.route('/session', methods=['GET'])
 def get_session():
-    """Get current user session"""
-    from utils.auth import get_current_user
-    
+    """Get current user session, answered from the access token's signed claims"""
     try:
-        user_id = get_current_user()
-        if not user_id:
+        claims = get_current_claims()
+        if not claims:
             return jsonify({"user": None}), 200
         
-        user = User.find_by_id(user_id)
+        # Tokens issued before claims were signed in still need the lookup
+        user = claims_user(claims) or User.find_by_id(claims['user_id'])
         if not user:
             return jsonify({"user": None}), 200
         
@@ -121,3 +140,57 @@ def get_session():
     except Exception as e:
         print(f"Session error: {e}")
         return jsonify({"error": "Internal Server Error"}), 500
+
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh():
+    """Exchange a refresh token for a new access/refresh token pair with current profile claims"""
+    try:
+        data = request.get_json(silent=True) or {}
+        claims = decode_claims(data.get('refreshToken') or '', token_type='refresh')
+        if not claims:
+            return jsonify({"error": "Invalid or expired refresh token"}), 401
+        
+        user = User.get_profile(claims['user_id'])
+        if not user:
+            return jsonify({"error": "Invalid or expired refresh token"}), 401
+        
+        return jsonify({
+            **generate_token_pair(user),
+            "user": {
+                "id": user['id'],
+                "email": user['email'],
+                "name": user['name']
+            }
+        }), 200
+        
+    except Exception as e:
+        print(f"Refresh error: {e}")
+        return jsonify({"error": "Internal Server Error"}), 500
+
+@auth_bp.route('/profile', methods=['PUT'])
+@require_auth
+def update_profile(current_user_id):
+    """Update the current user's name; older access tokens must be refreshed"""
+    try:
+        data = request.get_json(silent=True) or {}
+        name = (data.get('name') or '').strip()
+        if not name:
+            return jsonify({"error": "Name is required"}), 400
+        
+        user = User.update_profile(current_user_id, name)
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        profile_changed(user['id'], user['profileVersion'])
+        
+        return jsonify({
+            **generate_token_pair(user),
+            "user": {
+                "id": user['id'],
+                "email": user['email'],
+                "name": user['name']
+            }
+        }), 200
+        
+    except Exception as e:
+        print(f"Update profile error: {e}")
+        return jsonify({"error": "Failed to update profile"}), 500
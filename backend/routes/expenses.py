@@ -1,7 +1,13 @@
-from flask import Blueprint, request, jsonify
-from models.expense import Expense
+import json
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from config import Config
+from models.access import AccessError
+from models.expense import Expense, BulkImportError
 from models.group import Group
 from utils.auth import require_auth
+from utils.imports import read_csv_rows, prepare_expense_rows
+from utils.money import to_cents
+from utils.pagination import parse_page_args, page_response
 
 expenses_bp = Blueprint('expenses', __name__)
 
@@ -30,11 +36,13 @@ def create_expense(current_user_id):
         if not description or not amount or not group_id or not participant_ids:
             return jsonify({"error": "Missing required fields"}), 400
         
-        # Verify user is a member of the group
-        if not Group.is_member(group_id, current_user_id):
-            return jsonify({"error": "Forbidden"}), 403
+        try:
+            if to_cents(amount) <= 0:
+                raise ValueError(amount)
+        except ValueError:
+            return jsonify({"error": "Amount must be a positive number"}), 400
         
-        # Create expense (current user is the payer)
+        # Create expense (current user is the payer; membership is checked by the same query)
         expense = Expense.create(
             description=description,
             amount=amount,
@@ -48,30 +56,84 @@ def create_expense(current_user_id):
         # ---------------------------
 
         if not expense:
-            return jsonify({"error": "Failed to create expense"}), 500
+            return jsonify({"error": "Participants must be members of the group"}), 400
         
         return jsonify(expense), 201
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Create expense error: {e}")
         return jsonify({"error": "Failed to create expense"}), 500
-    
+
+@expenses_bp.route('/bulk', methods=['POST'])
+@require_auth
+def bulk_create_expenses(current_user_id):
+    """
+    Import many expenses into one group
+
+    Accepts JSON ({"groupId", "expenses": [...]}) or a text/csv body with
+    ?groupId=. Valid rows are written in batches; invalid rows are reported
+    back by row number. If a batch fails, the response gives the number
+    created before it and the row it started at.
+    """
+    try:
+        if request.mimetype == 'text/csv':
+            group_id = request.args.get('groupId')
+            rows = read_csv_rows(request.get_data(as_text=True))
+        else:
+            data = request.get_json(silent=True) or {}
+            group_id = data.get('groupId')
+            rows = data.get('expenses')
+
+        if not group_id or not isinstance(rows, list) or not rows:
+            return jsonify({"error": "Missing required fields"}), 400
+
+        if len(rows) > Config.BULK_IMPORT_MAX_ROWS:
+            return jsonify({"error": f"At most {Config.BULK_IMPORT_MAX_ROWS} expenses per import"}), 413
+
+        try:
+            batch_size = int(request.args.get('batchSize', Config.BULK_IMPORT_BATCH_SIZE))
+            if batch_size <= 0:
+                raise ValueError(batch_size)
+        except ValueError:
+            return jsonify({"error": "Invalid batchSize"}), 400
+
+        # One membership check for the whole import; the member list also resolves emails
+        group = Group.get_summary(group_id, current_user_id)
+
+        prepared, errors = prepare_expense_rows(rows, group['members'], current_user_id)
+        if not prepared:
+            return jsonify({"created": 0, "errors": errors}), 400
+
+        created = Expense.create_many(group_id, prepared, batch_size)
+
+        return jsonify({"created": created, "errors": errors}), 201
+
+    except BulkImportError as e:
+        print(f"Bulk create expenses error: {e.__cause__}")
+        return jsonify({
+            "error": str(e),
+            "created": e.created,
+            "failedRow": e.row,
+            "errors": errors
+        }), 500
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        print(f"Bulk create expenses error: {e}")
+        return jsonify({"error": "Failed to import expenses"}), 500
+
 @expenses_bp.route('/<expense_id>', methods=['GET'])
 @require_auth
 def get_expense(expense_id, current_user_id):
     """Get expense details"""
     try:
-        expense = Expense.find_by_id(expense_id)
-        
-        if not expense:
-            return jsonify({"error": "Expense not found"}), 404
-        
-        # Verify user is a member of the group
-        if not Group.is_member(expense['groupId'], current_user_id):
-            return jsonify({"error": "Forbidden"}), 403
-        
+        expense = Expense.find_by_id(expense_id, current_user_id)
         return jsonify(expense), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Get expense error: {e}")
         return jsonify({"error": "Failed to retrieve expense"}), 500
@@ -81,13 +143,11 @@ def get_expense(expense_id, current_user_id):
 def delete_expense(expense_id, current_user_id):
     """Delete an expense"""
     try:
-        success = Expense.delete(expense_id, current_user_id)
-        
-        if not success:
-            return jsonify({"error": "Forbidden or Not Found"}), 403
-        
+        Expense.delete(expense_id, current_user_id)
         return jsonify({"message": "Expense deleted successfully"}), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Delete expense error: {e}")
         return jsonify({"error": "Failed to delete expense"}), 500
@@ -95,15 +155,22 @@ def delete_expense(expense_id, current_user_id):
 @expenses_bp.route('/group/<group_id>', methods=['GET'])
 @require_auth
 def get_group_expenses(group_id, current_user_id):
-    """Get all expenses for a group"""
+    """Get expenses for a group (paginated with ?limit=&cursor=)"""
     try:
-        # Verify user is a member
-        if not Group.is_member(group_id, current_user_id):
-            return jsonify({"error": "Forbidden"}), 403
+        try:
+            limit, after = parse_page_args(request.args, Config.MAX_PAGE_SIZE)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        # Membership is checked by the same query
+        expenses = Expense.get_all_for_group(group_id, current_user_id, limit, after)
+        if limit is None:
+            return jsonify(expenses), 200
         
-        expenses = Expense.get_all_for_group(group_id)
-        return jsonify(expenses), 200
+        return jsonify(page_response(expenses, limit, key='expenses')), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Get group expenses error: {e}")
         return jsonify({"error": "Failed to retrieve expenses"}), 500
@@ -111,11 +178,34 @@ def get_group_expenses(group_id, current_user_id):
 @expenses_bp.route('/user', methods=['GET'])
 @require_auth
 def get_user_expenses(current_user_id):
-    """Get all expenses the current user is involved in"""
+    """Get expenses the current user is involved in (paginated with ?limit=&cursor=)"""
     try:
-        expenses = Expense.get_user_expenses(current_user_id)
-        return jsonify(expenses), 200
+        # Stream everything as NDJSON, one keyset page in memory at a time
+        if request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson':
+            return Response(stream_with_context(stream_user_expenses(current_user_id)),
+                            mimetype='application/x-ndjson')
+        
+        try:
+            limit, after = parse_page_args(request.args, Config.MAX_PAGE_SIZE)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        expenses = Expense.get_user_expenses(current_user_id, limit, after)
+        if limit is None:
+            return jsonify(expenses), 200
+        
+        return jsonify(page_response(expenses, limit, key='expenses')), 200
         
     except Exception as e:
         print(f"Get user expenses error: {e}")
-        return jsonify({"error": "Failed to retrieve expenses"}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to retrieve expenses"}), 500
+
+def stream_user_expenses(user_id):
+    """Yield a user's expenses as newline-delimited JSON"""
+    try:
+        for expense in Expense.iter_user_expenses(user_id, Config.STREAM_PAGE_SIZE):
+            yield json.dumps(expense) + "\n"
+    except Exception as e:
+        # Headers are already sent, so the best we can do is end with an error line
+        print(f"Stream user expenses error: {e}")
+        yield json.dumps({"error": "Failed to retrieve expenses"}) + "\n"
@@ -1,4 +1,5 @@
 from flask import Blueprint, request, jsonify
+from models.access import AccessError
 from models.group import Group
 from models.user import User
 from utils.auth import require_auth
@@ -30,15 +31,21 @@ def create_group(current_user_id):
 @groups_bp.route('/<group_id>', methods=['GET'])
 @require_auth
 def get_group(group_id, current_user_id):
-    """Get group details with members and expenses"""
+    """
+    Get group details with members and expenses (?view=summary skips the expenses,
+    ?format=normalized lists each user once in a top-level users map)
+    """
     try:
-        group = Group.get_with_details(group_id, current_user_id)
-        
-        if not group:
-            return jsonify({"error": "Forbidden or Not Found"}), 403
+        if request.args.get('view') == 'summary':
+            group = Group.get_summary(group_id, current_user_id)
+        else:
+            group = Group.get_with_details(group_id, current_user_id,
+                                           normalized=request.args.get('format') == 'normalized')
         
         return jsonify(group), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Get group error: {e}")
         return jsonify({"error": "Failed to retrieve group"}), 500
@@ -48,13 +55,11 @@ def get_group(group_id, current_user_id):
 def delete_group(group_id, current_user_id):
     """Delete a group and all its data"""
     try:
-        success = Group.delete(group_id, current_user_id)
-        
-        if not success:
-            return jsonify({"error": "Forbidden or Not Found"}), 403
-        
+        Group.delete(group_id, current_user_id)
         return jsonify({"message": "Group deleted successfully"}), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Delete group error: {e}")
         return jsonify({"error": "Failed to delete group"}), 500
@@ -70,13 +75,7 @@ def add_member(group_id, current_user_id):
         if not email:
             return jsonify({"error": "Email is required"}), 400
         
-        user_to_add = User.find_by_email(email)
-        if not user_to_add:
-            return jsonify({"error": "User with that email not found."}), 404
-        
-        if not Group.is_member(group_id, current_user_id):
-            return jsonify({"error": "Forbidden: You are not a member of this group."}), 403
-        
+        # Checks membership, looks up the new user and adds them in one query
         success = Group.add_member(group_id, email, current_user_id)
         
         if not success:
@@ -84,6 +83,8 @@ def add_member(group_id, current_user_id):
         
         return jsonify({"message": "User added successfully!"}), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Add member error: {e}")
         return jsonify({"error": "Failed to add member"}), 500
@@ -1,12 +1,32 @@
+import heapq
 from flask import Blueprint, request, jsonify
+from models.access import AccessError
 from models.settlement import Settlement
 from models.group import Group
-from models.expense import Expense
 from utils.auth import require_auth
-from utils.calculations import calculate_balances, settle_debts
+from utils.cache import balance_cache, netting_cache
+from utils.calculations import suggest_payments
+from utils.money import to_cents, from_cents
 
 settlements_bp = Blueprint('settlements', __name__)
 
+def parse_top_k(args):
+    """
+    Read the optional ?top_k= limit on suggested payments
+    
+    Returns:
+        int: The limit, or None if not given
+    
+    Raises:
+        ValueError: If it is not a positive integer
+    """
+    if 'top_k' not in args:
+        return None
+    top_k = args.get('top_k', type=int)
+    if top_k is None or top_k < 1:
+        raise ValueError("top_k must be a positive integer")
+    return top_k
+
 @settlements_bp.route('', methods=['POST'])
 @require_auth
 def create_settlement(current_user_id):
@@ -21,11 +41,13 @@ def create_settlement(current_user_id):
         if not group_id or not to_user_id or not amount:
             return jsonify({"error": "Missing required fields"}), 400
         
-        # Verify user is a member of the group
-        if not Group.is_member(group_id, current_user_id):
-            return jsonify({"error": "Forbidden"}), 403
+        try:
+            if to_cents(amount) <= 0:
+                raise ValueError(amount)
+        except ValueError:
+            return jsonify({"error": "Amount must be a positive number"}), 400
         
-        # Create settlement (current user is paying)
+        # Create settlement (current user is paying; membership is checked by the same query)
         settlement = Settlement.create(
             group_id=group_id,
             from_user_id=current_user_id,
@@ -34,10 +56,12 @@ def create_settlement(current_user_id):
         )
         
         if not settlement:
-            return jsonify({"error": "Failed to record settlement"}), 500
+            return jsonify({"error": "Recipient is not a member of this group"}), 400
         
         return jsonify(settlement), 201
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Create settlement error: {e}")
         return jsonify({"error": "Failed to record settlement"}), 500
@@ -47,13 +71,12 @@ def create_settlement(current_user_id):
 def get_group_settlements(group_id, current_user_id):
     """Get all settlements for a group"""
     try:
-        # Verify user is a member
-        if not Group.is_member(group_id, current_user_id):
-            return jsonify({"error": "Forbidden"}), 403
-        
-        settlements = Settlement.get_for_group(group_id)
+        # Membership is checked by the same query
+        settlements = Settlement.get_for_group(group_id, current_user_id)
         return jsonify(settlements), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Get settlements error: {e}")
         return jsonify({"error": "Failed to retrieve settlements"}), 500
@@ -63,33 +86,27 @@ def get_group_settlements(group_id, current_user_id):
 def get_group_balances(group_id, current_user_id):
     """Calculate and return balances and suggested payments for a group"""
     try:
-        # Verify user is a member
-        if not Group.is_member(group_id, current_user_id):
-            return jsonify({"error": "Forbidden"}), 403
-        
-        # Get group details
-        group = Group.get_with_details(group_id, current_user_id)
-        if not group:
-            return jsonify({"error": "Group not found"}), 404
+        try:
+            top_k = parse_top_k(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Get settlements
-        settlements = Settlement.get_for_group(group_id)
+        # A cheap version read verifies membership and tells whether the cache is current
+        version = Group.get_version(group_id, current_user_id)
         
-        # Calculate balances
-        balances = calculate_balances(
-            expenses=group['expenses'],
-            members=group['members'],
-            settlements=settlements
-        )
+        result = settle_group(group_id, version,
+                              lambda: Group.get_balances(group_id, current_user_id))
+        if result is None:
+            return jsonify({"error": "Forbidden"}), 403
         
-        # Generate payment suggestions
-        payments = settle_debts(balances)
+        # Optionally return only the largest few suggestions
+        if top_k is not None:
+            result = dict(result, settlements=result['settlements'][:top_k])
         
-        return jsonify({
-            "balances": balances,
-            "settlements": payments
-        }), 200
+        return jsonify(result), 200
         
+    except AccessError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Calculate balances error: {e}")
         return jsonify({"error": "Failed to calculate balances"}), 500
@@ -99,50 +116,127 @@ def get_group_balances(group_id, current_user_id):
 def get_all_balances(current_user_id):
     """Get balances across all groups for the current user"""
     try:
-        from models.user import User
-        
-        # Get all user's groups
-        groups = User.get_groups(current_user_id)
-        
-        all_balances = {}
-        all_settlements = []
-        
-        for group in groups:
-            # Get group details
-            group_details = Group.get_with_details(group['id'], current_user_id)
-            if not group_details:
-                continue
-            
-            # Get settlements
-            settlements = Settlement.get_for_group(group['id'])
-            
-            # Calculate balances for this group
-            balances = calculate_balances(
-                expenses=group_details['expenses'],
-                members=group_details['members'],
-                settlements=settlements
-            )
-            
-            # Generate payment suggestions
-            payments = settle_debts(balances)
-            
-            # Add to overall results
-            for user_id, balance in balances.items():
-                if user_id not in all_balances:
-                    all_balances[user_id] = 0.0
-                all_balances[user_id] += balance
-            
-            # Add group info to settlements
-            for payment in payments:
-                payment['groupId'] = group['id']
-                payment['groupName'] = group['name']
-                all_settlements.append(payment)
-        
-        return jsonify({
-            "balances": all_balances,
-            "settlements": all_settlements
-        }), 200
+        try:
+            top_k = parse_top_k(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        if request.args.get('net', '').lower() in ('1', 'true', 'yes'):
+            return jsonify(get_netted_balances(current_user_id, top_k)), 200
+        
+        # Read every group's ledger in a single round trip
+        groups = Group.get_balances_for_user(current_user_id)
+        return jsonify(summarize_groups(groups, top_k)), 200
         
     except Exception as e:
         print(f"Calculate all balances error: {e}")
-        return jsonify({"error": "Failed to calculate balances"}), 500
\ No newline at end of file
+        return jsonify({"error": "Failed to calculate balances"}), 500
+
+def summarize_groups(groups, top_k=None):
+    """
+    Combine the ledgers of a user's groups into the all-balances response
+    
+    Args:
+        groups: List of {id, name, version, balances} dicts, balances in cents
+        top_k: Only return the largest top_k payments overall (optional)
+    """
+    all_balances = {}
+    all_settlements = []
+    strategies = {}
+    
+    for group in groups:
+        balances = group['balances']
+        
+        # Generate payment suggestions (cached per group version)
+        result = settle_group(group['id'], group['version'], lambda: balances)
+        strategies[group['id']] = result['strategy']
+        
+        # Add to overall results
+        for user_id, balance in balances.items():
+            if user_id not in all_balances:
+                all_balances[user_id] = 0
+            all_balances[user_id] += balance
+        
+        # Add group info to settlements
+        for payment in result['settlements'][:top_k]:
+            all_settlements.append(dict(payment, groupId=group['id'], groupName=group['name']))
+    
+    # Each group's suggestions are already capped, keep the largest top_k overall
+    if top_k is not None:
+        all_settlements = heapq.nlargest(top_k, all_settlements, key=lambda payment: payment['amount'])
+    
+    return {
+        "balances": {user_id: from_cents(cents) for user_id, cents in all_balances.items()},
+        "settlements": all_settlements,
+        "strategies": strategies
+    }
+
+def settle_group(group_id, version, load_balances):
+    """
+    Get a group's balances and suggested payments at a given version
+    
+    Served from balance_cache while the group's version is unchanged;
+    load_balances is only called (and the solver only run) on a miss.
+    The full suggestion list is cached, largest first, so every ?top_k=
+    is a slice of it. Returns None if load_balances does.
+    """
+    result = balance_cache.get(group_id, version)
+    
+    if result is None:
+        balances = load_balances()
+        if balances is None:
+            return None
+        
+        payments, strategy = suggest_payments(balances)
+        result = {
+            "balances": {user_id: from_cents(cents) for user_id, cents in balances.items()},
+            "settlements": [dict(payment, amount=from_cents(payment['amount'])) for payment in payments],
+            "strategy": strategy
+        }
+        balance_cache.set(group_id, version, result)
+    
+    return result
+
+def get_netted_balances(user_id, top_k=None):
+    """
+    Settle a user's groups as one combined debt graph
+    
+    If A owes B in one group and B owes A in another, netting the balances
+    first suggests a single payment instead of two. Results are cached per set
+    of group versions, so the cheap version query is all a repeat poll costs.
+    
+    Only the user's own groups are netted, not every group reachable through
+    shared members: widening to that connected component would return the
+    balances of, and suggest payments between, users the caller shares no
+    group with.
+    """
+    versions = Group.get_versions_for_user(user_id)
+    result = netting_cache.get(user_id, tuple(sorted(versions.items())))
+    
+    if result is None:
+        groups = Group.get_balances_for_user(user_id)
+        result = net_groups(groups)
+        
+        # Key on the versions the balances were actually read at
+        netting_cache.set(user_id, tuple(sorted((group['id'], group['version']) for group in groups)), result)
+    
+    if top_k is not None:
+        result = dict(result, settlements=result['settlements'][:top_k])
+    
+    return result
+
+def net_groups(groups):
+    """Settle the ledgers of several groups ({id, version, balances} dicts) as one debt graph"""
+    combined = {}
+    for group in groups:
+        for member_id, balance in group['balances'].items():
+            combined[member_id] = combined.get(member_id, 0) + balance
+    
+    payments, strategy = suggest_payments(combined)
+    return {
+        "balances": {member_id: from_cents(cents) for member_id, cents in combined.items()},
+        "settlements": [dict(payment, amount=from_cents(payment['amount'])) for payment in payments],
+        "strategy": strategy,
+        "groupIds": [group['id'] for group in groups],
+        "netted": True
+    }
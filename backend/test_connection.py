@@ -5,15 +5,16 @@ Run this after setting up your .env file
 """
 
 import sys
-from database import driver, init_db
+from database import get_driver, init_db, close_driver
 from config import Config
+from models.expense import Expense
 
 def test_connection():
     """Test Neo4j connection"""
     print("🔍 Testing Neo4j connection...")
     try:
         # Verify the driver can connect
-        driver.verify_connectivity()
+        get_driver().verify_connectivity()
         print("✅ Successfully connected to Neo4j!")
         return True
     except Exception as e:
@@ -39,7 +40,7 @@ def test_basic_operations():
     """Test basic CRUD operations"""
     print("\n🔍 Testing basic CRUD operations...")
     try:
-        with driver.session(database=Config.NEO4J_DATABASE) as session:
+        with get_driver().session(database=Config.NEO4J_DATABASE) as session:
             # Create a test user
             result = session.run("""
                 CREATE (u:TestUser {id: 'test-123', name: 'Test User'})
@@ -87,7 +88,7 @@ def test_graph_queries():
     """Test graph-specific queries"""
     print("\n🔍 Testing graph queries...")
     try:
-        with driver.session(database=Config.NEO4J_DATABASE) as session:
+        with get_driver().session(database=Config.NEO4J_DATABASE) as session:
             # Create test data
             session.run("""
                 CREATE (u1:TestUser {id: '1', name: 'Alice'})
@@ -132,6 +133,57 @@ def test_graph_queries():
         print(f"❌ Graph queries failed: {e}")
         return False
 
+def plan_operators(plan):
+    """Flatten an EXPLAIN plan into its operator names"""
+    operators = [plan['operatorType'].split('@')[0]]
+    for child in plan.get('children', []):
+        operators.extend(plan_operators(child))
+    return operators
+
+def plan_details(plan):
+    """Flatten an EXPLAIN plan into (operator, details) pairs"""
+    details = [(plan['operatorType'].split('@')[0], str(plan.get('args', {}).get('Details', '')))]
+    for child in plan.get('children', []):
+        details.extend(plan_details(child))
+    return details
+
+def test_query_plans():
+    """Make sure hot queries traverse from their anchor node instead of scanning a label"""
+    print("\n🔍 Testing query plans...")
+    try:
+        with get_driver().session(database=Config.NEO4J_DATABASE) as session:
+            for limit in (None, 50):
+                summary = session.run("EXPLAIN " + Expense.user_expenses_query(limit),
+                                      userId='plan-check', limit=limit,
+                                      afterCreatedAt=None, afterId=None).consume()
+                operators = plan_operators(summary.plan)
+                scans = [op for op in operators if op in ('NodeByLabelScan', 'AllNodesScan')]
+                if scans:
+                    print(f"❌ Expense.get_user_expenses plan scans nodes: {', '.join(operators)}")
+                    return False
+            print("✅ Expense.get_user_expenses traverses from the user node")
+            
+            # Group pages must come off expense_group_created_idx in order, not a sort of the whole history
+            for after in (False, True):
+                summary = session.run("EXPLAIN " + Expense.group_expenses_query(50, after),
+                                      groupId='plan-check', userId='plan-check', limit=50,
+                                      afterCreatedAt='2024-01-01T00:00:00Z', afterId='').consume()
+                operators = plan_operators(summary.plan)
+                seeks = [detail for op, detail in plan_details(summary.plan)
+                         if op.startswith('NodeIndexSeek') and 'groupId' in detail]
+                # Top is ORDER BY + LIMIT over every candidate; the Sort after hydration only sees one page
+                full_sorts = [op for op in operators if op in ('Top', 'NodeByLabelScan', 'AllNodesScan')]
+                if not seeks or full_sorts:
+                    print(f"❌ Expense.get_all_for_group page plan does not use expense_group_created_idx: "
+                          f"{', '.join(operators)}")
+                    return False
+            print("✅ Expense.get_all_for_group pages read expense_group_created_idx in order")
+            
+            return True
+    except Exception as e:
+        print(f"❌ Query plan check failed: {e}")
+        return False
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -155,6 +207,7 @@ def main():
         all_passed &= test_constraints()
         all_passed &= test_basic_operations()
         all_passed &= test_graph_queries()
+        all_passed &= test_query_plans()
     
     print("\n" + "=" * 60)
     if all_passed:
@@ -165,7 +218,7 @@ def main():
     print("=" * 60)
     
     # Close driver
-    driver.close()
+    close_driver()
     sys.exit(0 if all_passed else 1)
 
 if __name__ == '__main__':
@@ -1,51 +1,222 @@
-import jwt
-import bcrypt
+# jwt and bcrypt are imported where they are used, so cold starts that never
+# hash or sign anything don't pay for loading them
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
+from threading import BoundedSemaphore, Lock
 from flask import request, jsonify
 from config import Config
+from utils.cache import token_cache
+
+class PasswordHasherBusy(Exception):
+    """Raised when the password hasher's queue is full; answer 429 and let the client retry"""
+    retry_after = 1
+
+class PasswordHasher:
+    """
+    Bounded executor that runs every bcrypt call
+    
+    At most `workers` hashes run at once and at most `queue_size` more wait,
+    so a login spike uses a fixed number of cores instead of every request
+    thread. Calls beyond that raise PasswordHasherBusy straight away.
+    """
+    
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.rejected = 0
+        self._slots = BoundedSemaphore(workers + queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._lock = Lock()
+    
+    def run(self, fn, *args):
+        """Run fn(*args) on the executor and wait for its result"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy("Too many logins in progress, please retry")
+        
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+    
+    def stats(self):
+        return {'workers': self.workers, 'rejected': self.rejected}
+
+# Created on first use, like the database driver
+_hasher = None
+_hasher_lock = Lock()
+
+def get_password_hasher():
+    """Get the process-wide PasswordHasher"""
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher(Config.BCRYPT_WORKERS, Config.BCRYPT_QUEUE_SIZE)
+    return _hasher
+
+def password_hasher_stats():
+    """Get the PasswordHasher's counters without starting its executor"""
+    if _hasher is None:
+        return {'workers': Config.BCRYPT_WORKERS, 'rejected': 0}
+    return _hasher.stats()
+
+def _hashpw(password, rounds):
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+def _checkpw(password, hashed_password):
+    import bcrypt
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def hash_password(password):
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    """Hash a password using bcrypt at Config.BCRYPT_ROUNDS; raises PasswordHasherBusy"""
+    return get_password_hasher().run(_hashpw, password, Config.BCRYPT_ROUNDS)
 
 def verify_password(password, hashed_password):
-    """Verify a password against its hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+    """Verify a password against its hash; raises PasswordHasherBusy"""
+    return get_password_hasher().run(_checkpw, password, hashed_password)
+
+def needs_rehash(hashed_password):
+    """Whether a bcrypt hash ($2b$<cost>$...) was made with a cost other than Config.BCRYPT_ROUNDS"""
+    try:
+        return int(hashed_password.split('$')[2]) != Config.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+# Profile version each user moved to in this process, and when. Access tokens
+# signed with an older one are refused here so the client refreshes; other
+# workers keep accepting them until they expire, after at most
+# Config.ACCESS_TOKEN_MINUTES, which is also when an entry can be dropped
+_profile_versions = {}
+_profile_versions_lock = Lock()
 
-def generate_token(user_id):
-    """Generate JWT token for user"""
+def generate_token(user_id, user=None, token_type='access'):
+    """
+    Generate a JWT for a user
+    
+    Access tokens live Config.ACCESS_TOKEN_MINUTES and, when `user` is given,
+    carry its email, name and profile version as signed claims so profile
+    reads can skip the database. Refresh tokens live Config.JWT_EXPIRATION_HOURS
+    and are only accepted by the refresh endpoint.
+    
+    Args:
+        user_id: Subject of the token
+        user: User dict with email, name and profileVersion (optional)
+        token_type: 'access' or 'refresh'
+    
+    Returns:
+        str: Encoded token
+    """
+    import jwt
+    now = datetime.utcnow()
+    if token_type == 'refresh':
+        lifetime = timedelta(hours=Config.JWT_EXPIRATION_HOURS)
+    else:
+        lifetime = timedelta(minutes=Config.ACCESS_TOKEN_MINUTES)
+    
     payload = {
         'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(hours=Config.JWT_EXPIRATION_HOURS),
-        'iat': datetime.utcnow()
+        'type': token_type,
+        'exp': now + lifetime,
+        'iat': now
     }
+    if user and token_type == 'access':
+        payload.update(email=user['email'], name=user['name'], pv=user.get('profileVersion') or 0)
     return jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm=Config.JWT_ALGORITHM)
 
-def decode_token(token):
-    """Decode JWT token and return user_id"""
-    try:
-        payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=[Config.JWT_ALGORITHM])
-        return payload['user_id']
-    except jwt.ExpiredSignatureError:
+def generate_token_pair(user):
+    """Generate an access token with profile claims and a refresh token for a user dict"""
+    return {
+        'token': generate_token(user['id'], user),
+        'refreshToken': generate_token(user['id'], token_type='refresh')
+    }
+
+def decode_claims(token, token_type='access'):
+    """
+    Verify a JWT and return its claims (tokens verified before come from token_cache)
+    
+    Returns:
+        dict: The claims, or None if the token is invalid, expired, of another
+        type, or an access token from before the user's last profile change
+    """
+    claims = token_cache.get(token)
+    if claims is None:
+        import jwt
+        try:
+            claims = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=[Config.JWT_ALGORITHM])
+        except jwt.InvalidTokenError:
+            return None
+        if 'exp' in claims:
+            token_cache.set(token, claims, claims['exp'])
+    
+    # Tokens issued before token types existed are access tokens
+    if claims.get('type', 'access') != token_type:
         return None
-    except jwt.InvalidTokenError:
+    if token_type == 'access' and claims.get('pv', 0) < _profile_versions.get(claims['user_id'], (0,))[0]:
         return None
+    return claims
+
+def decode_token(token):
+    """Decode JWT access token and return user_id"""
+    claims = decode_claims(token)
+    return claims['user_id'] if claims else None
+
+def claims_user(claims):
+    """The {id, email, name} signed into access token claims, or None for tokens without them"""
+    if 'email' not in claims or 'name' not in claims:
+        return None
+    return {'id': claims['user_id'], 'email': claims['email'], 'name': claims['name']}
+
+def profile_changed(user_id, profile_version):
+    """
+    Refuse this user's access tokens signed before profile_version, forcing a refresh
+    
+    Only this process learns of the change; tokens presented to other workers
+    stay valid, with their old claims, until they expire.
+    """
+    now = time.time()
+    with _profile_versions_lock:
+        # Every token signed before an entry this old has expired anyway
+        cutoff = now - Config.ACCESS_TOKEN_MINUTES * 60
+        for stale in [key for key, (_, changed_at) in _profile_versions.items() if changed_at < cutoff]:
+            del _profile_versions[stale]
+        
+        current = _profile_versions.get(user_id, (0,))[0]
+        _profile_versions[user_id] = (max(profile_version, current), now)
+    token_cache.revoke_user(user_id)
+
+def parse_auth_header(auth_header):
+    """
+    Get the token from a Bearer Authorization header
+    
+    Shared by the Flask and ASGI apps so both answer the same 401s.
+    
+    Returns:
+        tuple: (token, error) where token is None and error is the 401
+        message when the header is missing or malformed
+    """
+    if not auth_header:
+        return None, "Unauthorized - No token provided"
+    
+    parts = auth_header.split()
+    if len(parts) != 2 or parts[0].lower() != 'bearer':
+        return None, "Unauthorized - Invalid token format"
+    
+    return parts[1], None
 
 def require_auth(f):
     """Decorator to require authentication for routes"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        
-        if not auth_header:
-            return jsonify({"error": "Unauthorized - No token provided"}), 401
+        token, error = parse_auth_header(request.headers.get('Authorization'))
+        if error:
+            return jsonify({"error": error}), 401
         
-        parts = auth_header.split()
-        if len(parts) != 2 or parts[0].lower() != 'bearer':
-            return jsonify({"error": "Unauthorized - Invalid token format"}), 401
-        
-        token = parts[1]
         user_id = decode_token(token)
         
         if not user_id:
@@ -56,14 +227,12 @@ def require_auth(f):
     
     return decorated_function
 
+def get_current_claims():
+    """Get the verified access token claims of the current request, or None"""
+    token, error = parse_auth_header(request.headers.get('Authorization'))
+    return decode_claims(token) if not error else None
+
 def get_current_user():
     """Get current user ID from request token"""
-    auth_header = request.headers.get('Authorization')
-    if not auth_header:
-        return None
-    
-    parts = auth_header.split()
-    if len(parts) != 2 or parts[0].lower() != 'bearer':
-        return None
-    
-    return decode_token(parts[1])
+    claims = get_current_claims()
+    return claims['user_id'] if claims else None
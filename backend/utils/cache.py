@@ -0,0 +1,178 @@
+import hashlib
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from config import Config
+
+
+class CacheBackend(ABC):
+    """
+    Storage interface for the versioned caches
+    
+    Implement get/set/delete to move the caches out of process (for example
+    onto a shared key-value store); values only need to be picklable.
+    """
+    
+    @abstractmethod
+    def get(self, key, default=None):
+        """Get the value stored for key, or default"""
+    
+    @abstractmethod
+    def set(self, key, value):
+        """Store a value under key"""
+    
+    @abstractmethod
+    def delete(self, key):
+        """Drop the value stored for key if present"""
+
+
+class LRUCache(CacheBackend):
+    """A bounded, thread-safe least-recently-used cache"""
+    
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+    
+    def get(self, key, default=None):
+        """Get a value and mark it as recently used"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+    
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def delete(self, key):
+        """Drop a value if present"""
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def __len__(self):
+        return len(self._data)
+
+
+class VersionedCache:
+    """
+    Cache of computed values tagged with the version they were computed at
+    
+    A lookup only hits when the stored version equals the caller's current
+    version, so bumping a version invalidates every reader at once;
+    invalidate() additionally frees the entry straight away.
+    """
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+    
+    def get(self, key, version):
+        """Get the value cached for key if it was computed at this version"""
+        entry = self.backend.get(key)
+        hit = entry is not None and entry[0] == version
+        
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        
+        return entry[1] if hit else None
+    
+    def set(self, key, version, value):
+        """Cache a value computed at the given version"""
+        self.backend.set(key, (version, value))
+    
+    def invalidate(self, key):
+        """Drop whatever is cached for key"""
+        self.backend.delete(key)
+    
+    def stats(self):
+        """Get hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / total if total else 0.0
+        }
+
+
+class TokenCache:
+    """
+    Bearer tokens that already passed signature verification
+    
+    Entries are keyed by the token's SHA-256 digest, so raw tokens are never
+    kept, and hold the token's claims and exp. A lookup misses once exp
+    has passed, once the entry is older than `ttl` seconds, or if the user's
+    entries were revoked after it was cached.
+    """
+    
+    def __init__(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._revoked = {}
+        self._lock = Lock()
+    
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+    
+    def get(self, token):
+        """Get the claims of a verified token, or None if it must be verified again"""
+        entry = self.backend.get(self._key(token))
+        now = time.time()
+        hit = (entry is not None
+               and now < entry[1]
+               and now - entry[2] < self.ttl
+               and entry[2] > self._revoked.get(entry[0]['user_id'], 0))
+        
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        
+        return entry[0] if hit else None
+    
+    def set(self, token, claims, expires_at):
+        """Cache a verified token's claims until its exp (a Unix timestamp)"""
+        self.backend.set(self._key(token), (claims, expires_at, time.time()))
+    
+    def revoke_user(self, user_id):
+        """Make every token cached for a user miss, so each is verified again"""
+        now = time.time()
+        with self._lock:
+            # Entries cached before an old revocation have outlived ttl and miss anyway
+            for stale in [key for key, revoked_at in self._revoked.items() if now - revoked_at >= self.ttl]:
+                del self._revoked[stale]
+            self._revoked[user_id] = now
+    
+    def stats(self):
+        """Get hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / total if total else 0.0
+        }
+
+
+# Balances and suggested payments per group, keyed by group id at the group's version
+balance_cache = VersionedCache(LRUCache(Config.BALANCE_CACHE_SIZE))
+
+# Netted cross-group suggestions per user, keyed by user id at their groups' versions
+netting_cache = VersionedCache(LRUCache(Config.BALANCE_CACHE_SIZE))
+
+# Verified bearer tokens, so repeat requests with one token skip the HMAC check
+token_cache = TokenCache(LRUCache(Config.TOKEN_CACHE_SIZE), Config.TOKEN_CACHE_TTL)
@@ -1,30 +1,48 @@
+import heapq
+import time
+from config import Config
+from utils.money import split_cents
+
+
+def _expense_shares(expense):
+    """Get each participant's share in cents, splitting the amount if shares are not stored"""
+    participants = expense.get('participants', [])
+    shares = [p.get('shareCents') for p in participants]
+    if None in shares:
+        split = split_cents(expense.get('amountCents', 0), [p['id'] for p in participants])
+        shares = [split[p['id']] for p in participants]
+    return shares
+
+
 def calculate_balances(expenses, members, settlements=None):
     """
     Calculate balances for all members based on expenses and settlements
     
+    All amounts are integer cents, so balances are exact and always sum to zero.
+    
     Args:
-        expenses: List of expense dicts with amount, paidById, and participants
+        expenses: List of expense dicts with amountCents, paidById, and participants
+                  (participants may carry their stored shareCents)
         members: List of member dicts with id
-        settlements: List of settlement dicts (optional)
+        settlements: List of settlement dicts with amountCents (optional)
     
     Returns:
-        dict: userId -> balance mapping
+        dict: userId -> balance in cents
     """
     if settlements is None:
         settlements = []
     
     balances = {}
     for member in members:
-        balances[member['id']] = 0.0
+        balances[member['id']] = 0
     
     # Step 1: Calculate initial balances based on expenses
     for expense in expenses:
         payer_id = expense.get('paidById')
-        amount = float(expense.get('amount', 0))
+        amount = expense.get('amountCents', 0)
         participants = expense.get('participants', [])
-        num_participants = len(participants)
         
-        if num_participants == 0:
+        if not participants:
             continue
         
         # Credit the person who paid the full amount
@@ -32,8 +50,7 @@ def calculate_balances(expenses, members, settlements=None):
             balances[payer_id] += amount
         
         # Debit each participant for their share
-        share = amount / num_participants
-        for participant in participants:
+        for participant, share in zip(participants, _expense_shares(expense)):
             participant_id = participant['id']
             if participant_id in balances:
                 balances[participant_id] -= share
@@ -42,7 +59,7 @@ def calculate_balances(expenses, members, settlements=None):
     for settlement in settlements:
         from_user_id = settlement.get('fromUserId')
         to_user_id = settlement.get('toUserId')
-        amount = float(settlement.get('amount', 0))
+        amount = settlement.get('amountCents', 0)
         
         # The person who paid (the debtor) moves closer to zero (balance increases)
         if from_user_id in balances:
@@ -55,51 +72,176 @@ def calculate_balances(expenses, members, settlements=None):
     return balances
 
 
+def calculate_balances_from_totals(members, totals, flows=None):
+    """
+    Calculate balances from per-member totals aggregated in the database
+    
+    Args:
+        members: List of member dicts with id
+        totals: List of dicts with userId, paidCents and owedCents
+        flows: List of settlement dicts with fromUserId, toUserId and
+               amountCents, one per pair of users (optional)
+    
+    Returns:
+        dict: userId -> balance in cents
+    """
+    balances = calculate_balances([], members, flows)
+    
+    for total in totals:
+        user_id = total['userId']
+        if user_id in balances:
+            balances[user_id] += total['paidCents'] - total['owedCents']
+    
+    return balances
+
+
+def iter_settlements(balances):
+    """
+    Yield greedy payment suggestions, largest first
+    
+    Debtors and creditors sit on two heaps of (amount, index) tuples over
+    interned member indexes. Each step matches the largest debt with the
+    largest credit and pushes back whatever is left of either side, so the
+    amounts yielded never increase.
+    
+    Args:
+        balances: dict of userId -> balance in cents
+    
+    Yields:
+        dict: Payment with {from, to, amount} (amount in cents)
+    """
+    member_ids = list(balances)
+    
+    # Both heaps hold negated amounts so the largest debt/credit pops first
+    debtors = [(balance, i) for i, balance in enumerate(balances.values()) if balance < 0]
+    creditors = [(-balance, i) for i, balance in enumerate(balances.values()) if balance > 0]
+    heapq.heapify(debtors)
+    heapq.heapify(creditors)
+    
+    while debtors and creditors:
+        debt, debtor = heapq.heappop(debtors)
+        credit, creditor = heapq.heappop(creditors)
+        
+        amount_to_settle = min(-debt, -credit)
+        yield {
+            'from': member_ids[debtor],
+            'to': member_ids[creditor],
+            'amount': amount_to_settle
+        }
+        
+        if debt + amount_to_settle < 0:
+            heapq.heappush(debtors, (debt + amount_to_settle, debtor))
+        if credit + amount_to_settle < 0:
+            heapq.heappush(creditors, (credit + amount_to_settle, creditor))
+
+
 def settle_debts(balances):
     """
     Generate simplified payment suggestions to settle all debts
     
     Args:
-        balances: dict of userId -> balance
+        balances: dict of userId -> balance in cents
     
     Returns:
-        list: Array of payment dicts with {from, to, amount}
+        list: Array of payment dicts with {from, to, amount} (amount in cents),
+        largest first
     """
-    # Convert to list and filter out trivial amounts
-    sorted_balances = [
-        {'userId': user_id, 'balance': balance}
-        for user_id, balance in balances.items()
-        if abs(balance) > 0.01
-    ]
-    
-    # Separate debtors (negative) and creditors (positive)
-    debtors = sorted([b for b in sorted_balances if b['balance'] < 0], 
-                     key=lambda x: x['balance'])
-    creditors = sorted([b for b in sorted_balances if b['balance'] > 0], 
-                       key=lambda x: x['balance'], reverse=True)
+    return list(iter_settlements(balances))
+
+
+def settle_debts_optimal(balances, max_parties, time_budget_ms):
+    """
+    Generate the minimum number of payments that settles all debts
     
-    payments = []
-    debtor_idx = 0
-    creditor_idx = 0
+    Members whose balances cancel out can settle among themselves, so a group
+    that splits into k zero-sum subsets needs only n - k payments. The largest
+    such partition is found with a DP over bitmasks of the nonzero balances,
+    then each subset is settled with the greedy matcher (at most size - 1
+    payments per subset).
     
-    while debtor_idx < len(debtors) and creditor_idx < len(creditors):
-        debtor = debtors[debtor_idx]
-        creditor = creditors[creditor_idx]
+    Args:
+        balances: dict of userId -> balance in cents
+        max_parties: Largest number of nonzero balances to attempt (2^n states)
+        time_budget_ms: Wall-clock budget for the search
+    
+    Returns:
+        list | None: Payment dicts with {from, to, amount}, or None when the
+        group is over the size or time budget
+    """
+    parties = [(user_id, balance) for user_id, balance in balances.items() if balance != 0]
+    n = len(parties)
+    if n > max_parties:
+        return None
+    
+    deadline = time.monotonic() + time_budget_ms / 1000
+    size = 1 << n
+    sums = [0] * size
+    best = [0] * size
+    
+    # best[mask] = most zero-sum subsets the members in mask can be split into
+    for mask in range(1, size):
+        if mask & 0xFF == 0 and time.monotonic() > deadline:
+            return None
         
-        amount_to_settle = min(-debtor['balance'], creditor['balance'])
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + parties[low.bit_length() - 1][1]
         
-        payments.append({
-            'from': debtor['userId'],
-            'to': creditor['userId'],
-            'amount': amount_to_settle
-        })
-        
-        debtor['balance'] += amount_to_settle
-        creditor['balance'] -= amount_to_settle
+        most = 0
+        rest = mask
+        while rest:
+            bit = rest & -rest
+            if best[mask ^ bit] > most:
+                most = best[mask ^ bit]
+            rest ^= bit
+        best[mask] = most + (1 if sums[mask] == 0 else 0)
+    
+    # Walk the DP back, closing a subset every time the remaining members sum to zero
+    subsets = []
+    current = []
+    mask = size - 1
+    while mask:
+        target = best[mask] - (1 if sums[mask] == 0 else 0)
+        rest = mask
+        while rest:
+            bit = rest & -rest
+            if best[mask ^ bit] == target:
+                break
+            rest ^= bit
         
-        if abs(debtor['balance']) < 0.01:
-            debtor_idx += 1
-        if abs(creditor['balance']) < 0.01:
-            creditor_idx += 1
+        current.append(parties[bit.bit_length() - 1])
+        mask ^= bit
+        if sums[mask] == 0:
+            subsets.append(current)
+            current = []
+    
+    payments = []
+    for subset in subsets:
+        payments.extend(settle_debts(dict(subset)))
+    return payments
+
+
+def suggest_payments(balances):
+    """
+    Generate payment suggestions with the configured settle-up strategy
+    
+    Tries settle_debts_optimal within Config.SETTLE_OPTIMAL_MAX_PARTIES and
+    Config.SETTLE_TIME_BUDGET_MS and falls back to the greedy matcher. The
+    full list is always built: it is cached per group version, and ?top_k=
+    is cut from the cached list.
+    
+    Args:
+        balances: dict of userId -> balance in cents
+    
+    Returns:
+        tuple: (payments, strategy) where payments are largest first and
+        strategy is 'optimal' or 'greedy'
+    """
+    if Config.SETTLE_STRATEGY != 'greedy':
+        payments = settle_debts_optimal(balances,
+                                        Config.SETTLE_OPTIMAL_MAX_PARTIES,
+                                        Config.SETTLE_TIME_BUDGET_MS)
+        if payments is not None:
+            payments.sort(key=lambda payment: payment['amount'], reverse=True)
+            return payments, 'optimal'
     
-    return payments
\ No newline at end of file
+    return settle_debts(balances), 'greedy'
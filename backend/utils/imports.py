@@ -0,0 +1,120 @@
+import csv
+import io
+import uuid
+from datetime import datetime
+from utils.money import to_cents, from_cents, split_cents
+
+
+def read_csv_rows(text):
+    """
+    Read expense rows from CSV text
+
+    Expected columns: description, amount, participants (ids or emails
+    separated by ';') and optionally paidBy and date.
+
+    Returns:
+        list: Row dicts in the same shape as the JSON import
+    """
+    rows = []
+    for row in csv.DictReader(io.StringIO(text)):
+        participants = row.get('participants') or ''
+        rows.append({
+            'description': (row.get('description') or '').strip(),
+            'amount': (row.get('amount') or '').strip(),
+            'paidBy': (row.get('paidBy') or '').strip() or None,
+            'participants': [p.strip() for p in participants.split(';') if p.strip()],
+            'date': (row.get('date') or '').strip() or None
+        })
+    return rows
+
+
+def prepare_expense_rows(rows, members, default_payer_id):
+    """
+    Validate imported expense rows against the group's members
+
+    Payers and participants may be given by user id or email; participants
+    as a list or a comma-separated string. Valid rows get an id, integer cents
+    and their participants' shares precomputed so they can be written in bulk,
+    and keep their row number for error reports.
+
+    Args:
+        rows: List of row dicts (description, amount, paidBy/paidById,
+              participants/participantIds, optional date)
+        members: List of member dicts with id and email
+        default_payer_id: Payer used when a row does not name one
+
+    Returns:
+        tuple: (prepared rows, errors) where errors are {row, error} dicts
+               with 1-based row numbers
+    """
+    lookup = {}
+    for member in members:
+        lookup[member['id']] = member['id']
+        if member.get('email'):
+            lookup[member['email'].lower()] = member['id']
+
+    def resolve(ref):
+        if not isinstance(ref, str):
+            return None
+        return lookup.get(ref) or lookup.get(ref.lower())
+
+    prepared = []
+    errors = []
+
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({'row': number, 'error': 'Row must be an object'})
+            continue
+
+        description = row.get('description')
+        participant_refs = row.get('participantIds', row.get('participants')) or []
+        if isinstance(participant_refs, str):
+            participant_refs = [ref.strip() for ref in participant_refs.split(',') if ref.strip()]
+        elif not isinstance(participant_refs, list):
+            errors.append({'row': number, 'error': 'Participants must be a list'})
+            continue
+        if not description or not row.get('amount') or not participant_refs:
+            errors.append({'row': number, 'error': 'Missing required fields'})
+            continue
+
+        try:
+            amount_cents = to_cents(row['amount'])
+        except ValueError:
+            amount_cents = 0
+        if amount_cents <= 0:
+            errors.append({'row': number, 'error': 'Amount must be a positive number'})
+            continue
+
+        payer_ref = row.get('paidById', row.get('paidBy'))
+        payer_id = resolve(payer_ref) if payer_ref else default_payer_id
+        if payer_id is None:
+            errors.append({'row': number, 'error': f'Payer is not a member of this group: {payer_ref}'})
+            continue
+
+        participant_ids = [resolve(ref) for ref in participant_refs]
+        unknown = [ref for ref, pid in zip(participant_refs, participant_ids) if pid is None]
+        if unknown:
+            errors.append({'row': number, 'error': f'Not members of this group: {", ".join(map(str, unknown))}'})
+            continue
+
+        created_at = None
+        if row.get('date'):
+            try:
+                created_at = datetime.fromisoformat(str(row['date'])).isoformat()
+            except ValueError:
+                errors.append({'row': number, 'error': f'Invalid date: {row["date"]}'})
+                continue
+
+        shares = split_cents(amount_cents, participant_ids)
+        prepared.append({
+            'row': number,
+            'id': str(uuid.uuid4()),
+            'description': str(description),
+            'amount': from_cents(amount_cents),
+            'amountCents': amount_cents,
+            'paidById': payer_id,
+            'shares': [{'id': pid, 'shareCents': cents} for pid, cents in shares.items()],
+            'createdAt': created_at
+        })
+
+    return prepared, errors
@@ -0,0 +1,66 @@
+"""
+Faster JSON encoding for the Flask app
+
+OrjsonProvider swaps the stdlib encoder behind jsonify and request.get_json
+for orjson when it is installed (requirements-fast.txt). Output matches the
+default provider: keys stay sorted, and dates still go through Flask's
+default handler.
+"""
+from flask.json.provider import DefaultJSONProvider
+from config import Config
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """DefaultJSONProvider that encodes and decodes with orjson"""
+
+    def __init__(self, app):
+        super().__init__(app)
+        import orjson
+        self._orjson = orjson
+
+    def _encode(self, obj):
+        option = self._orjson.OPT_NON_STR_KEYS | self._orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            option |= self._orjson.OPT_SORT_KEYS
+        return self._orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        # orjson has no indent widths or custom separators
+        if set(kwargs) - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return self._orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Debug mode pretty-prints, which only the stdlib encoder does
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj) + b"\n", mimetype=self.mimetype)
+
+
+def install_json_provider(app):
+    """
+    Register the JSON provider chosen by Config.JSON_PROVIDER on a Flask app
+
+    'auto' uses orjson when it is installed, 'orjson' requires it and
+    'stdlib' keeps Flask's default.
+
+    Returns:
+        str: Name of the provider in use
+    """
+    if Config.JSON_PROVIDER == 'stdlib':
+        return 'stdlib'
+
+    try:
+        app.json = OrjsonProvider(app)
+    except ImportError:
+        if Config.JSON_PROVIDER == 'orjson':
+            raise
+        return 'stdlib'
+    return 'orjson'
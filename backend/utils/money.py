@@ -0,0 +1,58 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+CENTS_PER_UNIT = 100
+
+
+def to_cents(amount):
+    """
+    Convert a user-supplied amount into integer cents
+
+    Args:
+        amount: Amount in major units as a str, int, float or Decimal
+
+    Returns:
+        int: Amount in cents, rounded half up
+
+    Raises:
+        ValueError: If the amount is not a finite number
+    """
+    try:
+        value = Decimal(str(amount))
+    except (InvalidOperation, ValueError) as e:
+        raise ValueError(f"Invalid amount: {amount!r}") from e
+
+    if not value.is_finite():
+        raise ValueError(f"Invalid amount: {amount!r}")
+
+    return int((value * CENTS_PER_UNIT).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Convert integer cents back into a major-unit float for API responses"""
+    return cents / CENTS_PER_UNIT
+
+
+def split_cents(total_cents, participant_ids):
+    """
+    Split an amount between participants without losing a cent
+
+    Every participant gets the same base share. The remainder is handed out
+    one cent at a time in participant id order, so the split is deterministic
+    and matches the one Expense.create computes in Cypher.
+
+    Args:
+        total_cents: Amount to split in cents (non-negative)
+        participant_ids: Ids of the participants
+
+    Returns:
+        dict: participantId -> share in cents
+    """
+    ordered = sorted(set(participant_ids))
+    if not ordered:
+        return {}
+
+    base, remainder = divmod(total_cents, len(ordered))
+    return {
+        participant_id: base + (1 if i < remainder else 0)
+        for i, participant_id in enumerate(ordered)
+    }
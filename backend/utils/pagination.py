@@ -0,0 +1,91 @@
+import base64
+import json
+import re
+from datetime import datetime
+
+# An ISO 8601 timestamp as Neo4j and Python write them: Neo4j keeps nanoseconds,
+# which datetime.fromisoformat only accepts from Python 3.11
+_TIMESTAMP = re.compile(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.(\d{1,9}))?(Z|[+-]\d{2}:\d{2})?')
+
+
+def encode_cursor(item):
+    """
+    Build an opaque keyset cursor pointing just past an item
+    
+    Args:
+        item: Serialized record with createdAt (ISO string) and id
+    
+    Returns:
+        str: URL-safe cursor
+    """
+    raw = json.dumps([item['createdAt'], item['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor built by encode_cursor
+    
+    The timestamp is checked here so a tampered cursor is rejected before
+    Cypher's datetime() sees it.
+    
+    Returns:
+        tuple: (createdAt, id)
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    
+    if not isinstance(created_at, str) or not isinstance(item_id, str):
+        raise ValueError("Invalid cursor")
+    
+    match = _TIMESTAMP.fullmatch(created_at)
+    if not match:
+        raise ValueError("Invalid cursor")
+    
+    seconds, fraction, offset = match.groups()
+    try:
+        datetime.fromisoformat(seconds + (f'.{fraction[:6]:0<6}' if fraction else '')
+                               + ('+00:00' if offset == 'Z' else offset or ''))
+    except ValueError as e:
+        raise ValueError("Invalid cursor") from e
+    return created_at, item_id
+
+
+def parse_page_args(args, max_limit):
+    """
+    Read ?limit= and ?cursor= from request args
+    
+    Returns:
+        tuple: (limit, after) where limit is None when the client did not ask
+        for pagination and after is a decoded cursor or None
+    
+    Raises:
+        ValueError: "Invalid limit" or "Invalid cursor"
+    """
+    limit = args.get('limit')
+    cursor = args.get('cursor')
+    
+    if limit is None and cursor is None:
+        return None, None
+    
+    try:
+        limit = int(limit) if limit is not None else max_limit
+    except ValueError as e:
+        raise ValueError("Invalid limit") from e
+    if limit < 1:
+        raise ValueError("Invalid limit")
+    
+    return min(limit, max_limit), decode_cursor(cursor) if cursor else None
+
+
+def page_response(items, limit, key='items'):
+    """Wrap one page of items with the cursor for the next page"""
+    return {
+        key: items,
+        'nextCursor': encode_cursor(items[-1]) if items and len(items) == limit else None
+    }
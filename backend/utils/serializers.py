@@ -0,0 +1,159 @@
+"""
+Converters from Neo4j nodes to the dicts the API returns
+
+Models build every response through these, so each record type's fields,
+the datetime conversion and the user sub-objects are defined in one place.
+"""
+from operator import itemgetter
+
+
+def iso(value):
+    """
+    Convert a stored timestamp to the string the API returns
+
+    The one datetime path for every model: Neo4j and Python datetimes become
+    ISO 8601, strings pass through and anything else is stringified.
+    """
+    if value is None or type(value) is str:
+        return value
+    # neo4j.time types only reach isoformat through a slow __getattr__ alias
+    iso_format = getattr(value, 'iso_format', None)
+    if iso_format is not None:
+        return iso_format()
+    try:
+        return value.isoformat()
+    except AttributeError:
+        return str(value)
+
+
+class NodeSerializer:
+    """
+    Turns a node into a dict of selected properties
+
+    The property getter is compiled once per record type; properties named
+    in time_fields go through iso().
+    """
+
+    __slots__ = ('fields', 'time_fields', '_get')
+
+    def __init__(self, *fields, time_fields=()):
+        self.fields = fields
+        self.time_fields = time_fields
+        getter = itemgetter(*fields)
+        self._get = getter if len(fields) > 1 else (lambda node: (getter(node),))
+
+    def __call__(self, node):
+        data = dict(zip(self.fields, self._get(node)))
+        for field in self.time_fields:
+            data[field] = iso(data[field])
+        return data
+
+
+class NodeRefs:
+    """
+    Nested user or group objects for one response
+
+    Each node is serialized once per response and the same dict is shared
+    by every expense or settlement that references it.
+    """
+
+    __slots__ = ('serializer', '_refs')
+
+    def __init__(self, serializer):
+        self.serializer = serializer
+        self._refs = {}
+
+    def __call__(self, node):
+        if node is None:
+            return None
+        node_id = node['id']
+        ref = self._refs.get(node_id)
+        if ref is None:
+            ref = self._refs[node_id] = self.serializer(node)
+        return ref
+
+    def many(self, nodes):
+        """Serialize a list of nodes, skipping the nulls OPTIONAL MATCH leaves"""
+        return [self(node) for node in nodes if node is not None]
+
+    def all(self):
+        """Every node serialized so far, keyed by id"""
+        return self._refs
+
+
+USER = NodeSerializer('id', 'email', 'name')
+USER_REF = NodeSerializer('id', 'name')
+GROUP = NodeSerializer('id', 'name')
+EXPENSE = NodeSerializer('id', 'description', 'amount', 'createdAt', time_fields=('createdAt',))
+SETTLEMENT = NodeSerializer('id', 'amount', 'paidAt', time_fields=('paidAt',))
+
+
+def expense_dict(expense_node, paid_by, participants, users):
+    """
+    Serialize an expense with its payer and participants
+
+    Args:
+        expense_node: Expense node
+        paid_by: Payer user node (or None)
+        participants: Participant user nodes (nulls are skipped)
+        users: NodeRefs shared by the whole response
+
+    Returns:
+        dict: {id, description, amount, createdAt, paidById, paidBy, participants}
+    """
+    expense = EXPENSE(expense_node)
+    expense['paidById'] = paid_by['id'] if paid_by is not None else None
+    expense['paidBy'] = users(paid_by)
+    expense['participants'] = users.many(participants)
+    return expense
+
+
+def expense_ref_dict(expense_node, paid_by, participants, users):
+    """
+    Serialize an expense that references its payer and participants by id
+
+    The user objects are collected in `users` instead, for a response-level
+    users map (the normalized shape).
+
+    Returns:
+        dict: {id, description, amount, createdAt, paidById, participantIds}
+    """
+    expense = EXPENSE(expense_node)
+    expense['paidById'] = users(paid_by)['id'] if paid_by is not None else None
+    expense['participantIds'] = [users(node)['id'] for node in participants if node is not None]
+    return expense
+
+
+def normalize_group(group, users):
+    """
+    Move a group's members into a top-level users map next to the users its
+    expenses reference, leaving memberIds in their place
+
+    Args:
+        group: Group dict with members (and expenses built with expense_ref_dict)
+        users: NodeRefs the expenses were built with
+
+    Returns:
+        dict: The group, changed in place
+    """
+    members = group.pop('members')
+    group['memberIds'] = [member['id'] for member in members]
+    group['users'] = dict(users.all())
+    group['users'].update((member['id'], member) for member in members)
+    return group
+
+
+def profile_dict(user_node):
+    """Serialize a user with the profileVersion their access tokens are signed with"""
+    user = USER(user_node)
+    user['profileVersion'] = user_node['profileVersion'] or 0
+    return user
+
+
+def settlement_dict(settlement_node, group_id, from_user_id, to_user_id):
+    """Serialize a settlement with the ids of its group and both users"""
+    settlement = SETTLEMENT(settlement_node)
+    settlement['groupId'] = group_id
+    settlement['fromUserId'] = from_user_id
+    settlement['toUserId'] = to_user_id
+    return settlement
@@ -1,5 +1,10 @@
 // --- CONSTANTS ---
 const API_URL = '/api';
+const BOOKMARK_HEADER = 'X-Neo4j-Bookmarks';
+
+// Bookmarks from the latest response; sent back so reads served by a
+// follower still see this client's own writes
+let bookmarks = null;
 
 // --- API HELPER FUNCTIONS ---
 
@@ -8,6 +13,42 @@ const API_URL = '/api';
  */
 export const getAuthToken = () => localStorage.getItem('token');
 
+/**
+ * Stores (or clears) the access/refresh token pair returned by login and refresh
+ */
+export const setAuthTokens = (data) => {
+  if (data?.token) {
+    localStorage.setItem('token', data.token);
+    localStorage.setItem('refreshToken', data.refreshToken);
+  } else {
+    localStorage.removeItem('token');
+    localStorage.removeItem('refreshToken');
+  }
+};
+
+/**
+ * Trades the stored refresh token for a new token pair.
+ * Returns the refresh response ({ token, refreshToken, user }) or null.
+ */
+export const refreshSession = async () => {
+  const refreshToken = localStorage.getItem('refreshToken');
+  if (!refreshToken) return null;
+
+  const response = await fetch(`${API_URL}/auth/refresh`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ refreshToken }),
+  });
+  if (!response.ok) {
+    setAuthTokens(null);
+    return null;
+  }
+
+  const data = await response.json();
+  setAuthTokens(data);
+  return data;
+};
+
 /**
  * Creates headers for API requests
  */
@@ -16,25 +57,45 @@ export const getAuthHeaders = () => {
   return {
     'Content-Type': 'application/json',
     ...(token && { 'Authorization': `Bearer ${token}` }),
+    ...(bookmarks && { [BOOKMARK_HEADER]: bookmarks }),
   };
 };
 
+/**
+ * Remembers the bookmarks a response carries for the next requests
+ */
+const saveBookmarks = (response) => {
+  const header = response.headers.get(BOOKMARK_HEADER);
+  if (header) bookmarks = header;
+  return response;
+};
+
+/**
+ * fetch with auth headers; access tokens are short-lived, so a 401 is
+ * retried once after refreshing the token pair
+ */
+const authFetch = async (endpoint, options) => {
+  const send = () => fetch(`${API_URL}${endpoint}`, { ...options, headers: getAuthHeaders() })
+    .then(saveBookmarks);
+  const response = await send();
+  if (response.status === 401 && !endpoint.startsWith('/auth/') && await refreshSession()) {
+    return send();
+  }
+  return response;
+};
+
 /**
  * A wrapper for fetch that handles auth and JSON
  */
 export const api = {
   get: async (endpoint) => {
-    const response = await fetch(`${API_URL}${endpoint}`, {
-      method: 'GET',
-      headers: getAuthHeaders(),
-    });
+    const response = await authFetch(endpoint, { method: 'GET' });
     if (!response.ok) throw new Error(`API Error: ${response.statusText}`);
     return response.json();
   },
   post: async (endpoint, body) => {
-    const response = await fetch(`${API_URL}${endpoint}`, {
+    const response = await authFetch(endpoint, {
       method: 'POST',
-      headers: getAuthHeaders(),
       body: JSON.stringify(body),
     });
     if (!response.ok) {
@@ -44,10 +105,7 @@ export const api = {
     return response.json();
   },
   delete: async (endpoint) => {
-    const response = await fetch(`${API_URL}${endpoint}`, {
-      method: 'DELETE',
-      headers: getAuthHeaders(),
-    });
+    const response = await authFetch(endpoint, { method: 'DELETE' });
     if (!response.ok) {
       const errorData = await response.json();
       throw new Error(errorData.error || response.statusText);
@@ -1,5 +1,5 @@
 import { createContext, useContext, useState, useEffect, useMemo } from 'react';
-import { api, getAuthToken } from '../api/api';
+import { api, getAuthToken, setAuthTokens, refreshSession } from '../api/api';
 
 const AuthContext = createContext();
 
@@ -22,17 +22,19 @@ export function AuthProvider({ children }) {
       const storedToken = getAuthToken();
       if (storedToken) {
         try {
+          // The session is read from the access token; once it expires, refresh it
           const data = await api.get('/auth/session');
-          if (data.user) {
-            setUser(data.user);
-            setToken(storedToken);
+          const session = data.user ? data : await refreshSession();
+          if (session?.user) {
+            setUser(session.user);
+            setToken(getAuthToken());
           } else {
-            localStorage.removeItem('token');
+            setAuthTokens(null);
             setToken(null);
           }
         } catch (error) {
           console.error("Session check failed:", error);
-          localStorage.removeItem('token');
+          setAuthTokens(null);
           setToken(null);
         }
       }
@@ -44,7 +46,7 @@ export function AuthProvider({ children }) {
   const login = async (email, password) => {
     try {
       const data = await api.post('/auth/login', { email, password });
-      localStorage.setItem('token', data.token);
+      setAuthTokens(data);
       setToken(data.token);
       setUser(data.user);
       return { success: true };
@@ -63,7 +65,7 @@ export function AuthProvider({ children }) {
   };
 
   const logout = () => {
-    localStorage.removeItem('token');
+    setAuthTokens(null);
     setToken(null);
     setUser(null);
   };